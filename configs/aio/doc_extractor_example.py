@@ -6,6 +6,6 @@ from webarticlecurator import WarcCachingDownloader
 logger = Logger('extractor.log', logfile_level='DEBUG', console_level='DEBUG')
 for file in glob('new/*.warc.gz'):
     wac = WarcCachingDownloader(file, None, logger, just_cache=True, download_params={'allow_empty_warc': True})
-    for url in wac.url_index:
-        doc_content = wac.download_url(url, decode=False)  # TODO Set true for only HTML, XML and such files
-        # TODO save or handle the document as needed
+    # The documents are read in the order of the WARC file
+    for url, doc_content in wac.download_many(wac.url_index, decode=False):  # TODO Set true for only HTML, XML...
+        pass  # TODO save or handle the document as needed
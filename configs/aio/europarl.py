@@ -94,19 +94,20 @@ def main():
                                                                 'known_bad_urls': 'known_bad_urls.txt'})
     LANGS = ('BG', 'ES', 'CS', 'DA', 'DE', 'ET', 'EL', 'EN', 'FR', 'GA', 'HR', 'IT', 'LV', 'LT', 'HU', 'MT', 'NL', 'PL',
              'PT', 'RO', 'SK', 'SL', 'FI', 'SV', 'NO', 'IS')
-    # Init dowloaders
+    # Init dowloader: one session and rate limit for all documents routed to separate WARCs by language and format
     # TODO Substitute None with one or (a list of) more exsisting warc.gz files to be used as cache
     #  (e.g. continuing the interrupted crawling)
-    #  (e.g. f'old/europarl_documents_{lang}_{file_format}.warc.gz')
-    downloaders = {(lang, file_format):
-                       WarcCachingDownloader(None,
-                                             f'new/europarl_documents_{lang}_{file_format}.warc.gz',
-                                             logger,
-                                             download_params={'err_threshold': 10000,
-                                                              'allow_empty_warc': True,
-                                                              'known_bad_urls': 'known_bad_urls.txt'})
-                   for lang in LANGS for file_format
-                    in ('DOC', 'HTML', 'PDF', 'Official Journal', 'PDF - authentic OJ', 'External link', 'e-signature')}
+    #  (e.g. [f'old/europarl_documents_{lang}_{file_format}.warc.gz' for lang in LANGS for file_format in ...])
+    def route_documents_by_lang_and_format(_, lang_and_format):
+        lang, file_format = lang_and_format
+        return f'new/europarl_documents_{lang}_{file_format}.warc.gz'
+
+    documents_downloader = WarcCachingDownloader(None,
+                                                 route_documents_by_lang_and_format,
+                                                 logger,
+                                                 download_params={'err_threshold': 10000,
+                                                                  'allow_empty_warc': True,
+                                                                  'known_bad_urls': 'known_bad_urls.txt'})
     # Header
     # TODO Set filenames accordingly or it will be unconditionally overwritten!
     with open('documents_by_lang_and_format.tsv', 'w', encoding='UTF-8') as output, \
@@ -186,9 +187,10 @@ def main():
                     lang_str = str(lang.a.span.get_text().strip())
                     doc_link = str(lang.a['href']).replace('./../../../', 'https://eur-lex.europa.eu/')
                     # Decode only on non-PDF and DOC files
-                    downloaders[(lang_str, format_str)]. \
-                     download_url(doc_link,
-                                  decode=format_str not in {'DOC', 'PDF', 'PDF - authentic OJ', 'External link'})
+                    documents_downloader. \
+                        download_url(doc_link,
+                                     decode=format_str not in {'DOC', 'PDF', 'PDF - authentic OJ', 'External link'},
+                                     route_key=(lang_str, format_str))
                     if lang_str not in d:
                         logger.log('ERROR', f'Unknown language ({lang_str}) for {link}')
                         continue
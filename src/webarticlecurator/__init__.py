@@ -4,10 +4,12 @@
 # TODO Logger is defined here for legacy reasons to be dropped on 2.0.0
 from mplogger import Logger
 from .utils import wrap_input_constants, DummyConverter, create_or_check_clean_dir, \
-    write_content_to_url_named_file
+    write_content_to_url_named_file, accepts_bytes
 from .enhanced_downloader import WarcCachingDownloader
+from .charset_detector import HTMLBytes
+from .url_normalizer import UrlNormalizer
 from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, \
-    archive_page_contains_article_url
+    archive_page_contains_article_url, merge_warc_files, partition_warc_file
 from .news_crawler import NewsArchiveCrawler, NewsArticleCrawler
 from .strategies import gen_article_urls_and_subpages, date_range, infinite_scrolling, until_maxpagenum, \
     intersecting_pages, stop_on_empty_or_taboo
@@ -15,4 +17,5 @@ from .version import __version__
 
 __all__ = ['NewsArchiveCrawler', 'NewsArticleCrawler', 'DummyConverter', 'WarcCachingDownloader', 'Logger',
            'wrap_input_constants', 'gen_article_urls_and_subpages', 'date_range', 'infinite_scrolling',
-           'until_maxpagenum', 'intersecting_pages', 'stop_on_empty_or_taboo', __version__]
+           'until_maxpagenum', 'intersecting_pages', 'stop_on_empty_or_taboo', 'accepts_bytes', 'HTMLBytes',
+           'UrlNormalizer', __version__]
@@ -7,9 +7,14 @@ from argparse import ArgumentParser, ArgumentTypeError, FileType
 from mplogger import Logger
 
 from .version import  __version__
-from .utils import wrap_input_constants
+from .utils import wrap_input_constants, DurabilityPolicy
+from .rate_limiter import AIMDRateController, SharedFileRateLimiter, ByteRateLimiter, shared_rate_limiter
+from .retry_scheduler import RetryPolicy
+from .proxy_pool import PROXY_SELECTION_STRATEGIES, ProxyPool, read_proxy_urls
+from .failure_store import FailureStore
 from .news_crawler import NewsArchiveCrawler, NewsArticleCrawler
-from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, archive_page_contains_article_url
+from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, archive_page_contains_article_url, \
+    merge_warc_files, partition_warc_file
 
 
 def str2bool(v):
@@ -25,6 +30,17 @@ def str2bool(v):
         raise ArgumentTypeError('Boolean value expected.')
 
 
+def burst_size(v):
+    """At least one request must fit into a burst"""
+    try:
+        size = int(v)
+    except ValueError:
+        raise ArgumentTypeError(f'Integer value expected: {v}')
+    if size < 1:
+        raise ArgumentTypeError(f'Burst size must be at least 1: {v}')
+    return size
+
+
 def parse_args_crawl(parser):
     parser.add_argument(dest='command', choices={'crawl'}, metavar='crawl',
                         help='Crawl a portal with the supplied configuration and arguments')
@@ -53,24 +69,96 @@ def parse_args_crawl(parser):
     parser.add_argument('--user-agent', type=str, help='The User-Agent string to use in headers while downloading')
     parser.add_argument('--no-overwrite-warc', help='Do not overwrite --{archive,articles}-warc if needed',
                         action='store_false')
-    parser.add_argument('--cumulative-error-threshold', type=int, help='Sum of download errors before giving up',
-                        default=15)
+    parser.add_argument('--host-error-threshold', '--cumulative-error-threshold', type=int, default=15,
+                        help='The number of consecutive download errors on a host before pausing it')
+    parser.add_argument('--host-pause', type=float, help='Pause the failing host for this many seconds before probing'
+                                                         ' it again (doubled after each failed probe)', default=60.0)
+    parser.add_argument('--max-host-pause', type=float, help='The maximal pause of a failing host in seconds',
+                        default=3600.0)
     parser.add_argument('--known-bad-urls', type=str, help='Known bad URLs to be excluded from download (filename, '
                                                            'one URL per line)', default=None)
+    parser.add_argument('--failure-store', type=str, default=None, metavar='FILE',
+                        help='Remember the failing URLs between the runs in this file to skip them for a while'
+                             ' (see --failure-backoff) or for good (see --failure-permanent-after)')
+    parser.add_argument('--failure-backoff', type=float, default=86400.0,
+                        help='Do not retry a failed URL for this many seconds (doubled after each further failure)')
+    parser.add_argument('--failure-permanent-after', type=int, default=3,
+                        help='Mark the URL permanently bad after this many failures in a row')
     parser.add_argument('--known-article-urls', type=str, help='Known article URLs to mark the desired end of '
                                                                'the archive (filename, one URL per line)', default=None)
-    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period',
-                        default=2)
-    parser.add_argument('--limit-period', type=int, help='Limit (seconds) the period the number of HTTP request'
-                                                         ' see also --max-no-of-calls-in-period',
+    parser.add_argument('--max-no-of-calls-in-period', type=float, help='Limit number of HTTP request per period'
+                                                                        ' and host', default=2)
+    parser.add_argument('--limit-period', type=float, help='Limit (seconds) the period the number of HTTP request'
+                                                           ' see also --max-no-of-calls-in-period',
                         default=1)
+    parser.add_argument('--rate-limit-burst', type=burst_size, help='The number of HTTP requests allowed in a burst'
+                                                                    ' (default: --max-no-of-calls-in-period rounded'
+                                                                    ' up)', default=None)
+    parser.add_argument('--rate-limit-state-dir', type=str, default=None, metavar='DIR',
+                        help='Share the rate limit of the hosts with the other processes using the same directory')
+    parser.add_argument('--max-bytes-per-second', type=float, help='Limit the download bandwidth in total'
+                                                                   ' (default: no limit)', default=None)
+    parser.add_argument('--max-host-bytes-per-second', type=float, help='Limit the download bandwidth per host'
+                                                                        ' (default: no limit)', default=None)
+    parser.add_argument('--adaptive-rate', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Adapt the request rate (AIMD) to the latency and errors starting from'
+                             ' --max-no-of-calls-in-period / --limit-period')
+    parser.add_argument('--min-rate', type=float, help='Lower bound of --adaptive-rate (requests/second)', default=0.1)
+    parser.add_argument('--max-rate', type=float, help='Upper bound of --adaptive-rate (requests/second)', default=10)
+    parser.add_argument('--deferred-retries', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Retry the failed downloads later with exponential backoff and'
+                                                   ' continue with other URLs meanwhile instead of retrying at once')
+    parser.add_argument('--retry-max-tries', type=int, help='The number of tries before giving up on an URL',
+                        default=3)
+    parser.add_argument('--retry-base-delay', type=float, help='The delay before the first retry in seconds'
+                                                               ' (doubled for each further retry)', default=1.0)
+    parser.add_argument('--retry-max-delay', type=float, help='The maximal delay before a retry in seconds'
+                                                              ' (also caps Retry-After)', default=300.0)
     parser.add_argument('--proxy-url', type=str, help='SOCKS Proxy URL to use eg. socks5h://localhost:9050',
                         default=None)
+    parser.add_argument('--proxy-pool', type=str, nargs='+', metavar='PROXY_URL', default=[],
+                        help='Spread the requests over these proxies (instead of --proxy-url)')
+    parser.add_argument('--proxy-pool-file', type=str, help='File of proxy URLs (one per line) for the proxy pool',
+                        default=None)
+    parser.add_argument('--proxy-selection', choices=PROXY_SELECTION_STRATEGIES, default='round-robin',
+                        help='How to select the proxy for the next request (default: round-robin)')
+    parser.add_argument('--proxy-rate', type=float, help='Max. no. of requests per second through each proxy'
+                                                         ' (default: no limit)', default=None)
+    parser.add_argument('--proxy-error-threshold', type=int, help='Take the proxy out of rotation after this many'
+                                                                  ' consecutive connection errors', default=3)
+    parser.add_argument('--pool-maxsize', type=int, help='The number of connections kept alive per host', default=10)
+    parser.add_argument('--keep-alive', type=str2bool, nargs='?', const=True, default=True, metavar='True/False',
+                        help='Enable TCP keep-alive on the pooled connections (default: True)')
+    parser.add_argument('--dns-cache-ttl', type=float, help='Cache the DNS lookups for this many seconds'
+                                                            ' (0: no caching)', default=300.0)
+    parser.add_argument('--http2', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Use HTTP/2 where the server supports it (requires the httpx[http2] package)')
+    parser.add_argument('--connect-timeout', type=float, help='Connect timeout in seconds', default=10.0)
+    parser.add_argument('--read-timeout', type=float, help='Timeout in seconds between two received bytes',
+                        default=30.0)
+    parser.add_argument('--total-timeout', type=float, help='Timeout in seconds for the whole download of a page'
+                                                            ' (headers and body)', default=300.0)
+    parser.add_argument('--slow-host-threshold', type=float, help='Consider the host slow when its 95th percentile'
+                                                                  ' download time exceeds this many seconds',
+                        default=10.0)
+    parser.add_argument('--resume-partial', type=str2bool, nargs='?', const=True, default=True, metavar='True/False',
+                        help='Resume the interrupted downloads with Range requests (default: True)')
+    parser.add_argument('--partial-dir', type=str, help='The directory to keep the partially downloaded pages in',
+                        default=None)
+    parser.add_argument('--compressed-transfer', type=str2bool, nargs='?', const=True, default=True,
+                        metavar='True/False', help='Accept gzip, deflate (and br) compressed responses (default: True)')
     parser.add_argument('--allow-cookies', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Allow session cookies')
     parser.add_argument('--stay-offline', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Do not download, but write output WARC (see --just-cache when no output warcfile'
                              ' is needed)')
+    parser.add_argument('--durability', type=str, choices=DurabilityPolicy.modes, default='interval',
+                        help='When to flush the output WARC and URL list files: on close only (none), every'
+                             ' --flush-interval seconds (interval, DEFAULT) or after every record (per-record)')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='Seconds between two flushes of the output files with --durability interval')
+    parser.add_argument('--fsync', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Call fsync after every flush of the output files')
 
     # Mutually exclusive group...
     group = parser.add_mutually_exclusive_group()
@@ -135,11 +223,14 @@ def parse_args_sample(parser):
                         help='Allow session cookies')
     parser.add_argument('--max-tries', type=int, help='No of maximal tries if the download fails because duplicate '
                                                       'articles', default=3)
-    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period',
-                        default=2)
-    parser.add_argument('--limit-period', type=int, help='Limit (seconds) the period the number of HTTP request'
-                                                         ' see also --max-no-of-calls-in-period',
+    parser.add_argument('--max-no-of-calls-in-period', type=float, help='Limit number of HTTP request per period'
+                                                                        ' and host', default=2)
+    parser.add_argument('--limit-period', type=float, help='Limit (seconds) the period the number of HTTP request'
+                                                           ' see also --max-no-of-calls-in-period',
                         default=1)
+    parser.add_argument('--rate-limit-burst', type=burst_size, help='The number of HTTP requests allowed in a burst'
+                                                                    ' (default: --max-no-of-calls-in-period rounded'
+                                                                    ' up)', default=None)
     args = parser.parse_args()
     if (args.source_warcfile is None or len(args.source_warcfile) == 0) and args.offline:
         print('Must specify at least one SOURCE_WARC if --offline is False!', file=sys.stderr)
@@ -183,16 +274,82 @@ def parse_args_checkurls(parser):
     return parser.parse_args()
 
 
+def parse_args_merge(parser):
+    parser.add_argument(dest='command', choices={'merge'}, metavar='merge',
+                        help='Merge warc files (created by this program) into one compacted warc file'
+                             ' keeping the last occurrence of each URL')
+    parser.add_argument('-s', '--source-warcfile', type=str, metavar='SOURCE WARCFILE', nargs='+', required=True,
+                        help='Warc files (created by this program) to merge (later ones have priority)')
+    parser.add_argument('target_warcfile', type=str, metavar='TARGET_WARCFILE', help='The name of the target warc file')
+    parser.add_argument('--max-size', type=int, default=None, metavar='BYTES',
+                        help='Roll the target warc file at this size (TARGET-00000.warc.gz, TARGET-00001.warc.gz, ...)')
+    return parser.parse_args()
+
+
+def parse_args_partition(parser):
+    parser.add_argument(dest='command', choices={'partition'}, metavar='partition',
+                        help='Split warc files (created by this program) into shards for parallel processing')
+    parser.add_argument('-s', '--source-warcfile', type=str, metavar='SOURCE WARCFILE', nargs='+', required=True,
+                        help='Warc files (created by this program) to split (later ones have priority)')
+    parser.add_argument('target_warcfile', type=str, metavar='TARGET_WARCFILE',
+                        help='The name of the target warc file (the shard key is appended to it for each shard)')
+    parser.add_argument('--by', type=str, choices=('hash', 'month', 'column'), default='hash',
+                        help='Split by the hash of the URL into --shards shards (DEFAULT), by the month of the'
+                             ' WARC-Date or by the archive_url_format prefixes of the columns in the site schema'
+                             ' of --config')
+    parser.add_argument('--shards', type=int, default=2, help='The number of shards for --by hash')
+    parser.add_argument('-c', '--config', type=str, default=None, metavar='CONFIG_FILE_NAME',
+                        help='Portal configfile (see configs folder for examples!) for --by column')
+    args = parser.parse_args()
+    if args.by == 'column' and args.config is None:
+        print('Must specify --config for --by column !', file=sys.stderr)
+        exit(1)
+    return args
+
+
 def main_crawl(args):
     """ read input data from the given files, initialize variables """
     portal_settings = wrap_input_constants(args.config)
+    if args.rate_limit_state_dir is not None:
+        rate_limiter = SharedFileRateLimiter(args.rate_limit_state_dir)
+    else:
+        rate_limiter = shared_rate_limiter
+    byte_rate_limiter = None
+    if args.max_bytes_per_second is not None or args.max_host_bytes_per_second is not None:
+        byte_rate_limiter = ByteRateLimiter(args.max_bytes_per_second, args.max_host_bytes_per_second)
+    proxy_urls = list(args.proxy_pool)
+    if args.proxy_pool_file is not None:
+        proxy_urls.extend(read_proxy_urls(args.proxy_pool_file))
+    proxy_pool = None
+    if len(proxy_urls) > 0:  # Shared by the archive and the article crawler
+        proxy_pool = ProxyPool(proxy_urls, args.proxy_selection, args.proxy_rate,
+                               failure_threshold=args.proxy_error_threshold, open_timeout=args.host_pause,
+                               max_open_timeout=args.max_host_pause)
+    failure_store = None
+    if args.failure_store is not None:  # Shared by the archive and the article crawler
+        failure_store = FailureStore(args.failure_store, args.failure_backoff, args.failure_permanent_after)
     # These parameters go down directly to the downloader
     download_params = {'program_name': args.crawler_name, 'user_agent': args.user_agent,
-                       'overwrite_warc': args.no_overwrite_warc, 'err_threshold': args.cumulative_error_threshold,
+                       'overwrite_warc': args.no_overwrite_warc, 'err_threshold': args.host_error_threshold,
                        'known_bad_urls': args.known_bad_urls, 'strict_mode': args.strict,
                        'max_no_of_calls_in_period': args.max_no_of_calls_in_period, 'limit_period': args.limit_period,
-                       'proxy_url': args.proxy_url, 'allow_cookies': args.allow_cookies,
-                       'stay_offline': args.stay_offline, 'verify_request': portal_settings['verify_request']}
+                       'rate_limit_burst': args.rate_limit_burst, 'rate_limiter': rate_limiter,
+                       'byte_rate_limiter': byte_rate_limiter, 'failure_store': failure_store,
+                       'rate_controller': AIMDRateController(rate_limiter, args.min_rate, args.max_rate)
+                       if args.adaptive_rate else None,
+                       'host_pause': args.host_pause, 'max_host_pause': args.max_host_pause,
+                       'retry_policy': RetryPolicy(args.retry_max_tries, args.retry_base_delay, args.retry_max_delay)
+                       if args.deferred_retries else None,
+                       'proxy_url': args.proxy_url, 'proxy_pool': proxy_pool, 'allow_cookies': args.allow_cookies,
+                       'compressed_transfer': args.compressed_transfer, 'pool_maxsize': args.pool_maxsize,
+                       'keep_alive': args.keep_alive, 'dns_cache_ttl': args.dns_cache_ttl, 'http2': args.http2,
+                       'connect_timeout': args.connect_timeout, 'read_timeout': args.read_timeout,
+                       'total_timeout': args.total_timeout, 'slow_host_threshold': args.slow_host_threshold,
+                       'resume_partial': args.resume_partial, 'partial_dir': args.partial_dir,
+                       'stay_offline': args.stay_offline, 'verify_request': portal_settings['verify_request'],
+                       'max_body_size': portal_settings['max_body_size'],
+                       'allowed_content_types': portal_settings['allowed_content_types'],
+                       'durability': DurabilityPolicy(args.durability, args.flush_interval, args.fsync)}
     if args.archive:
         # For the article links only...
         archive_crawler = NewsArchiveCrawler(portal_settings, args.old_archive_warc, args.archive_warc,
@@ -200,12 +357,16 @@ def main_crawl(args):
                                              download_params)
         for url in archive_crawler.url_iterator():  # Get the list of urls in the archive...
             print(url, flush=True)
+        archive_crawler.close()
     else:
         articles_crawler = NewsArticleCrawler(portal_settings, args.old_articles_warc, args.articles_warc,
                                               args.old_archive_warc, args.archive_warc, args.articles_just_cache,
                                               args.archive_just_cache, args.known_article_urls, args.debug_params,
                                               download_params)
         articles_crawler.download_and_extract_all_articles()
+        articles_crawler.close()
+    if failure_store is not None:
+        failure_store.close()
 
 
 def main_validate_and_list(args):
@@ -244,7 +405,7 @@ def main_cat_and_sample(args):
                         extract_article_urls_from_page_plus_fun=extract_article_urls_from_page_plus_fun,
                         max_tries=max_tries, allow_cookies=allow_cookies,
                         max_no_of_calls_in_period=args.max_no_of_calls_in_period,
-                        limit_period=args.limit_period)
+                        limit_period=args.limit_period, rate_limit_burst=args.rate_limit_burst)
     main_logger.log('INFO', 'Done!')
 
 
@@ -260,6 +421,27 @@ def main_checkurls(args):
     main_logger.log('INFO', 'Done!')
 
 
+def main_merge(args):
+    """ __file__ merge [source warcfiles] [target warcfile] [max size] """
+    main_logger = Logger()
+    for filename in merge_warc_files(args.source_warcfile, args.target_warcfile, main_logger, args.max_size):
+        main_logger.log('INFO', 'Created', filename, 'and its index file')
+    main_logger.log('INFO', 'Done!')
+
+
+def main_partition(args):
+    """ __file__ partition [source warcfiles] [target warcfile] [by] [shards] [config] """
+    main_logger = Logger()
+    columns = None
+    if args.config is not None:
+        columns = wrap_input_constants(args.config)['columns']
+    shards = partition_warc_file(args.source_warcfile, args.target_warcfile, main_logger, args.by, args.shards,
+                                 columns)
+    for shard_key, filename in sorted(shards.items()):
+        main_logger.log('INFO', 'Created', filename, 'for shard', shard_key)
+    main_logger.log('INFO', 'Done!')
+
+
 def main_download(args):
     """ __file__ download [URL] [target warcfile] """
     main_logger = Logger()
@@ -274,7 +456,8 @@ def main():
                 'listurls': (parse_args_validate_and_list, main_validate_and_list),
                 'sample': (parse_args_sample, main_cat_and_sample), 'download': (parse_args_donwload, main_download),
                 'cat': (parse_args_cat, main_cat_and_sample), 'crawl': (parse_args_crawl, main_crawl),
-                'checkurls': (parse_args_checkurls, main_checkurls)}
+                'checkurls': (parse_args_checkurls, main_checkurls), 'merge': (parse_args_merge, main_merge),
+                'partition': (parse_args_partition, main_partition)}
     parser = ArgumentParser()
     parser.add_argument('command', choices=commands.keys(), metavar='COMMAND',
                         help=f'Please choose from the available commands ({commands.keys()})'
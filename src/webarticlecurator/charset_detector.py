@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import re
+from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE, BOM_UTF32_BE, BOM_UTF32_LE, lookup, getincrementaldecoder
+from threading import Lock
+from urllib.parse import urlparse
+
+from chardet import detect
+
+# UTF-32 first as the UTF-32 LE BOM starts with the UTF-16 LE BOM
+BOMS = ((BOM_UTF8, 'utf-8-sig'), (BOM_UTF32_LE, 'utf-32'), (BOM_UTF32_BE, 'utf-32'), (BOM_UTF16_LE, 'utf-16'),
+        (BOM_UTF16_BE, 'utf-16'))
+# <meta charset="..."> and <meta http-equiv="Content-Type" content="text/html; charset=..."> and <?xml encoding="..."?>
+META_CHARSET_RE = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.\-]+)', re.IGNORECASE)
+XML_ENCODING_RE = re.compile(rb'<\?xml[^>]+?encoding\s*=\s*["\']([a-zA-Z0-9_:.\-]+)["\']', re.IGNORECASE)
+# The Hungarian ő, ű, Ő, Ű in ISO-8859-2 are the rare õ, û, Õ, Û in ISO-8859-1
+HUNGARIAN_LATIN2_BYTES = re.compile(rb'[\xd5\xdb\xf5\xfb]')
+
+
+class HTMLBytes(bytes):
+    """
+        The raw bytes of a page with its known or sniffed encoding (None if unknown) for the parsers which decode
+         natively, e.g. BeautifulSoup(page, 'lxml', from_encoding=page.encoding)
+    """
+    def __new__(cls, data, encoding=None):
+        obj = super().__new__(cls, data)
+        obj.encoding = encoding
+        return obj
+
+
+def normalize_encoding(name):
+    """The canonical Python codec name of the encoding or None if it is unknown"""
+    try:
+        return lookup(name.strip().lower()).name
+    except (LookupError, UnicodeError):
+        return None
+
+
+class CharsetDetector:
+    """
+        Detect the encoding of the pages without charset in the Content-Type header with a pipeline from the cheapest
+         to the most expensive step:
+         1. byte order mark
+         2. <meta charset> (or http-equiv Content-Type or XML declaration) in the first sniff_bytes bytes
+         3. valid UTF-8 in the first sample_bytes bytes
+         4. chardet on the first sample_bytes bytes (ISO-8859-1 and Windows-1252 are corrected to their Central
+             European counterparts if the Hungarian ő and ű are found as chardet is known to be weak on Hungarian)
+        The result is remembered per host and the first path segment (e.g. /cikk/): after memo_after pages with the
+         same encoding the detection is skipped for the following pages (forget() it if the decoding fails)
+    """
+    def __init__(self, sniff_bytes=4096, sample_bytes=65536, memo_after=3):
+        self._sniff_bytes = sniff_bytes
+        self._sample_bytes = sample_bytes
+        self._memo_after = memo_after
+        self._memo = {}  # (host, path pattern) -> [encoding, no. of pages detected with the same encoding]
+        self._lock = Lock()
+
+    @staticmethod
+    def _memo_key(url):
+        parsed_url = urlparse(url)
+        first_segment = parsed_url.path.lstrip('/').split('/', 1)[0]
+        if first_segment.isdigit():  # E.g. /2020/01/... are the same pattern
+            first_segment = '#'
+        return parsed_url.netloc, first_segment
+
+    def detect(self, url, data):
+        """The encoding of the page (memoized for stable sites) or None if it can not be detected"""
+        key = self._memo_key(url)
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[1] >= self._memo_after:
+                return memo[0]
+
+        enc = self.detect_encoding(data)
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] == enc:
+                memo[1] += 1
+            else:
+                self._memo[key] = [enc, 1]
+        return enc
+
+    def sniff(self, url, data):
+        """The remembered encoding or the one found by the cheap steps (BOM, <meta charset>) only or None"""
+        key = self._memo_key(url)
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[1] >= self._memo_after:
+                return memo[0]
+        return self.sniff_encoding(data)
+
+    def forget(self, url):
+        with self._lock:
+            self._memo.pop(self._memo_key(url), None)
+
+    def detect_encoding(self, data):
+        """Run the detection pipeline without memoization"""
+        enc = self.sniff_encoding(data)
+        if enc is not None:
+            return enc
+
+        sample = data[:self._sample_bytes]
+        try:  # The sample may end with an incomplete multibyte character
+            getincrementaldecoder('utf-8')().decode(sample, final=len(sample) == len(data))
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+
+        enc = detect(sample)['encoding']
+        if enc is None:
+            return None
+        enc = normalize_encoding(enc)
+        if enc in {'iso8859-1', 'cp1252'} and HUNGARIAN_LATIN2_BYTES.search(sample) is not None:
+            enc = 'iso8859-2' if enc == 'iso8859-1' else 'cp1250'
+        return enc
+
+    def sniff_encoding(self, data):
+        """The cheap steps of the pipeline: the BOM and the declared encoding in the beginning of the document"""
+        for bom, enc in BOMS:
+            if data.startswith(bom):
+                return enc
+
+        head = data[:self._sniff_bytes]
+        for regex in (META_CHARSET_RE, XML_ENCODING_RE):
+            m = regex.search(head)
+            if m is not None:
+                enc = normalize_encoding(m.group(1).decode('ascii'))
+                if enc is not None:
+                    if enc.startswith('utf-16') or enc.startswith('utf-32'):  # The document is ASCII compatible
+                        enc = 'utf-8'
+                    return enc
+        return None
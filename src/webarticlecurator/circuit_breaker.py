@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from threading import Lock
+from time import monotonic
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class HostCircuitBreakers:
+    """
+        Per-host circuit breakers to pause only the failing hosts instead of aborting the whole crawl
+         - closed: requests are allowed, failure_threshold consecutive failures open the circuit (only the failures
+            of the host count: network errors, timeouts, HTTP 429 and 5xx, not e.g. HTTP 404)
+         - open: requests are refused for open_timeout seconds
+         - half-open: after the timeout one probe request is allowed, its success closes the circuit, its failure opens
+            it again for a doubled timeout (at most max_open_timeout seconds), if the probe could not be sent
+            (e.g. invalid URL) the next request can be the probe
+        The methods return the new state on state changes (else None) to be able to log them
+    """
+    def __init__(self, failure_threshold=10, open_timeout=60.0, max_open_timeout=3600.0):
+        if failure_threshold < 1 or open_timeout <= 0 or max_open_timeout < open_timeout:
+            raise ValueError(f'Invalid circuit breaker settings: failure_threshold ({failure_threshold}) >= 1 and'
+                             f' 0 < open_timeout ({open_timeout}) <= max_open_timeout ({max_open_timeout})'
+                             f' must hold!')
+        self._failure_threshold = failure_threshold
+        self._open_timeout = open_timeout
+        self._max_open_timeout = max_open_timeout
+        self._hosts = {}  # Host -> [state, consecutive failures, open until, actual open timeout]
+        self._lock = Lock()
+
+    def _get_host(self, host):
+        host_state = self._hosts.get(host)
+        if host_state is None:
+            host_state = [CLOSED, 0, 0.0, self._open_timeout]
+            self._hosts[host] = host_state
+        return host_state
+
+    def check(self, host):
+        """Return None if a request to the host is allowed now, else the seconds until the next probe is allowed"""
+        with self._lock:
+            host_state = self._get_host(host)
+            state, _, open_until, timeout = host_state
+            if state == CLOSED:
+                return None
+            now = monotonic()
+            if state == OPEN and now >= open_until:
+                host_state[0] = HALF_OPEN  # Let one probe through, the others wait for its outcome
+                return None
+            return max(open_until - now, 0.0) if state == OPEN else timeout
+
+    def record_success(self, host):
+        with self._lock:
+            host_state = self._get_host(host)
+            old_state = host_state[0]
+            host_state[:] = [CLOSED, 0, 0.0, self._open_timeout]
+        if old_state != CLOSED:
+            return CLOSED
+        return None
+
+    def release_probe(self, host):
+        """The probe request could not be sent: let the next request probe the host"""
+        with self._lock:
+            host_state = self._get_host(host)
+            if host_state[0] == HALF_OPEN:
+                host_state[0] = OPEN
+                host_state[2] = monotonic()
+
+    def record_failure(self, host):
+        with self._lock:
+            host_state = self._get_host(host)
+            state, failures, _, timeout = host_state
+            if state == HALF_OPEN:  # The probe failed: wait longer
+                timeout = min(self._max_open_timeout, timeout * 2)
+            elif state == CLOSED and failures + 1 < self._failure_threshold:
+                host_state[1] += 1
+                return None
+            elif state == OPEN:  # Requests started before opening the circuit
+                return None
+            host_state[:] = [OPEN, 0, monotonic() + timeout, timeout]
+        return OPEN
+
+    def open_timeout(self, host):
+        """The actual timeout of the host (to be logged)"""
+        with self._lock:
+            return self._get_host(host)[3]
+
+    def states(self):
+        """Host -> state for the hosts which are not closed"""
+        with self._lock:
+            return {host: host_state[0] for host, host_state in self._hosts.items() if host_state[0] != CLOSED}
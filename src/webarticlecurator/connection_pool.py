@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import socket
+from ipaddress import ip_address
+from threading import Lock
+from time import monotonic
+from collections import Counter, defaultdict
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+
+class DNSCache:
+    """
+        In-process DNS cache: the addresses of a host are resolved at most once in ttl seconds
+         (failed lookups are not cached)
+    """
+    def __init__(self, ttl=300.0):
+        self._ttl = ttl
+        self._cache = {}  # (host, port) -> (expiry time, [addresses])
+        self._lock = Lock()
+        self.lookups = Counter()  # Host -> no. of real lookups
+
+    def resolve(self, host, port):
+        """Return the addresses of the host (cached) or an empty list if it can not be resolved"""
+        try:
+            ip_address(host.strip('[]'))
+            return [host]  # Already an address
+        except ValueError:
+            pass
+
+        key = (host, port)
+        now = monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        try:
+            addr_infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            return []  # Let the connection raise the proper error
+        addresses = list(dict.fromkeys(sockaddr[0] for *_, sockaddr in addr_infos))  # Unique, keep order
+        with self._lock:
+            self._cache[key] = (now + self._ttl, addresses)
+            self.lookups[host] += 1
+        return addresses
+
+
+class ConnectionStats:
+    """Per-host connection reuse statistics: new connections, reused connections and TLS handshakes"""
+    def __init__(self):
+        self._stats = defaultdict(Counter)
+        self._lock = Lock()
+
+    def count(self, host, event):
+        with self._lock:
+            self._stats[host][event] += 1
+
+    def stats(self):
+        """Host -> (no. of new connections, no. of reused connections, no. of TLS handshakes)"""
+        with self._lock:
+            return {host: (counts['new'], counts['reused'], counts['tls'])
+                    for host, counts in self._stats.items()}
+
+
+class _InstrumentedConnection:
+    stats = None
+    dns_cache = None
+
+    def _new_conn(self):
+        if self.dns_cache is None:
+            sock = super()._new_conn()
+        else:
+            sock = self._new_conn_via_dns_cache()
+        self.stats.count(self.host, 'new')
+        return sock
+
+    def _new_conn_via_dns_cache(self):
+        dns_host = self._dns_host
+        addresses = self.dns_cache.resolve(dns_host, self.port)
+        if len(addresses) == 0:
+            return super()._new_conn()
+        err = None
+        for address in addresses:  # Try the addresses in order as socket.create_connection() does
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except (NewConnectionError, ConnectTimeoutError) as e:
+                err = e
+            finally:
+                self._dns_host = dns_host
+        raise err
+
+    def connect(self):
+        super().connect()
+        if isinstance(self, HTTPSConnection):
+            self.stats.count(self.host, 'tls')
+
+
+class _InstrumentedPool:
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        if getattr(conn, 'sock', None) is not None:  # Pooled and still alive
+            self.stats.count(self.host, 'reused')
+        return conn
+
+
+def _instrumented_pool_classes(pool_classes_by_scheme, stats, dns_cache):
+    ret = {}
+    for scheme, pool_cls in pool_classes_by_scheme.items():
+        conn_cls = type(f'Instrumented{pool_cls.ConnectionCls.__name__}',
+                        (_InstrumentedConnection, pool_cls.ConnectionCls), {'stats': stats, 'dns_cache': dns_cache})
+        ret[scheme] = type(f'Instrumented{pool_cls.__name__}', (_InstrumentedPool, pool_cls),
+                           {'ConnectionCls': conn_cls, 'stats': stats})
+    return ret
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+        HTTPAdapter with explicit per-host connection pools (pool_maxsize connections kept alive per host
+         for pool_connections hosts), TCP keep-alive on the pooled connections, optional DNS cache
+         and connection reuse statistics (see ConnectionStats)
+        Through a proxy the DNS cache is not used as the proxy resolves the host names (e.g. socks5h://)
+    """
+    def __init__(self, pool_connections=100, pool_maxsize=10, keep_alive=True, dns_cache=None, stats=None):
+        self._keep_alive = keep_alive
+        self._dns_cache = dns_cache
+        if stats is None:
+            stats = ConnectionStats()
+        self.stats = stats
+        super().__init__(pool_connections, pool_maxsize)
+
+    def _socket_options(self):
+        socket_options = list(HTTPConnection.default_socket_options)
+        if self._keep_alive:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        return socket_options
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault('socket_options', self._socket_options())
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = \
+            _instrumented_pool_classes(self.poolmanager.pool_classes_by_scheme, self.stats, self._dns_cache)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if proxy in self.proxy_manager:
+            return self.proxy_manager[proxy]
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = _instrumented_pool_classes(manager.pool_classes_by_scheme, self.stats, None)
+        return manager
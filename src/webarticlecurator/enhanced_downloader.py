@@ -5,25 +5,76 @@
 
 import sys
 from io import BytesIO
+from math import ceil, inf
+from time import monotonic, sleep
+from weakref import WeakKeyDictionary
+from threading import local
+from asyncio import Semaphore, get_running_loop, new_event_loop, wait, wrap_future, gather, FIRST_COMPLETED
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from zlib import compressobj, DEFLATED, MAX_WBITS, error as ZlibError
 from pathlib import Path
-from collections import Counter
+from collections import Counter, defaultdict
 from urllib.parse import urlparse, quote, urlunparse
 
 from warcio.warcwriter import WARCWriter
+from warcio.recordbuilder import RecordBuilder
 from warcio.exceptions import ArchiveLoadFailed
 from warcio.archiveiterator import ArchiveIterator
 from warcio.statusandheaders import StatusAndHeaders
+from warcio.bufferedreaders import BufferedReader
 
 from requests import Session
-from requests.exceptions import RequestException
+from requests.exceptions import RequestException, ConnectionError as RequestsConnectionError, Timeout
+from requests.structures import CaseInsensitiveDict
 
 from urllib3 import disable_warnings
-from urllib3.exceptions import ProtocolError, InsecureRequestWarning, LocationParseError
+from urllib3.exceptions import ProtocolError, InsecureRequestWarning, LocationParseError, ReadTimeoutError
 
-from chardet import detect
-from ratelimit import limits, sleep_and_retry
+from .utils import DurabilityPolicy
+from .rate_limiter import shared_rate_limiter
+from .retry_scheduler import RETRYABLE_STATUS_CODES, RetryScheduler, parse_retry_after
+from .circuit_breaker import HostCircuitBreakers, OPEN
+from .connection_pool import DNSCache, PooledHTTPAdapter
+from .http2_adapter import Http2Adapter
+from .slow_host_detector import SlowHostDetector
+from .partial_downloads import PartialDownloads, resume_validator, parse_content_range
+from .proxy_pool import redact_proxy_url
+from .charset_detector import CharsetDetector, HTMLBytes
 
-respv_str = {10: '1.0', 11: '1.1'}
+respv_str = {10: '1.0', 11: '1.1', 20: '2'}
+SERVER_NOT_MODIFIED_PROFILE = 'http://netpreserve.org/warc/1.1/revisit/server-not-modified'
+# The content encodings which can be decoded by warcio when reading the WARC file (br if brotli is installed)
+ACCEPT_ENCODING = ', '.join(enc for enc in ('gzip', 'deflate', 'br') if enc in BufferedReader.DECOMPRESSORS)
+
+
+# The compressed bytes are decoded in blocks of this size (at most ~1 MB decoded for gzip and deflate at once)
+DECODE_BLOCK_SIZE = 1024
+
+
+def decode_content_encoding(data, content_encoding, max_size=None):
+    """
+        Decode the (still compressed) bytes of the payload in the same way as warcio does when reading records
+        The decoding is incremental: it stops as soon as the decoded payload exceeds max_size bytes (ResponseRejected),
+         so compression bombs are not inflated into the memory
+    """
+    if content_encoding is None or content_encoding.strip().lower() in {'', 'identity'}:
+        return data
+    decomp_type = content_encoding.strip().lower()
+    if decomp_type not in BufferedReader.DECOMPRESSORS:
+        raise ValueError(f'Unsupported Content-Encoding: {content_encoding}')
+    reader = BufferedReader(BytesIO(data), block_size=DECODE_BLOCK_SIZE, decomp_type=decomp_type)
+    if max_size is None:
+        return reader.read()
+    content = reader.read(max_size + 1)
+    if len(content) > max_size:
+        raise ResponseRejected(f'Decoded body exceeds the size limit ({max_size} bytes)')
+    return content
+
+
+class ResponseRejected(Exception):
+    """The response is not wanted (too large or not allowed content type): not a network error, do not retry"""
+    pass
 
 # Patch get_encoding_from_headers in requests
 
@@ -80,6 +131,42 @@ def patched_get_encoding_from_headers(headers):
         return 'utf-8'
 
 
+def redirect_chain(resp):
+    """The URLs from the requested to the final one if requests followed redirects (else an empty list)"""
+    if len(resp.history) == 0:
+        return []
+    return [prev_resp.url for prev_resp in resp.history] + [resp.url]
+
+
+def add_redirect_aliases(aliases, url, chain):
+    """Map the URLs of the redirect chain (see the WARC-X-Redirect-Chain header) to the URL of the record"""
+    for alias in chain:
+        if alias != url:
+            aliases[alias] = url
+
+
+def default_warcinfo_record_data(program_name='WebArticleCurator'):
+    # INFO RECORD
+    # Some custom information about the warc writer program and its settings
+    return {'software': program_name, 'arguments': ' '.join(sys.argv[1:]), 'format': 'WARC File Format 1.1',
+            'conformsTo': 'http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1-1_latestdraft.pdf'}
+
+
+def numbered_warc_filename(filename, num):
+    """E.g. dir/filename.warc.gz -> dir/filename-00001.warc.gz"""
+    return labelled_warc_filename(filename, f'{num:05d}')
+
+
+def labelled_warc_filename(filename, label):
+    """E.g. dir/filename.warc.gz -> dir/filename-label.warc.gz"""
+    filename = Path(filename)
+    stem, ext = filename.stem, filename.suffix
+    # Should be filename.warc.gz
+    if ext == '.gz' and stem.endswith('.warc'):
+        stem, ext = stem[:-5], '.warc.gz'
+    return str(filename.with_name(f'{stem}-{label}{ext}'))
+
+
 class WarcCachingDownloader:
     """
         This class optionally applies the supplied existing warc archive to retrieve the downloaded pages from cache
@@ -88,22 +175,38 @@ class WarcCachingDownloader:
 
         It basically wraps WarcReader and WarcDownloader classes which do the hard work.
 
+        new_warc_filename can also be a routing function: route_fun(url, route_key) -> filename to distribute
+         the records of one download session (with shared HTTP session, rate limit and URL bookkeeping) into multiple
+         output WARC files by the route_key supplied to download_url() (e.g. by the language and format of documents).
+
+        The URLs which were redirected to an URL already in the (cached or new) WARC files are aliases of its record:
+         they are served from the record instead of downloading the same page again (see WARC-X-Redirect-Chain)
+
+        With an url_normalizer (see UrlNormalizer) the URLs are canonicalized before the lookups and the download,
+         the canonical form of a cached URL stands for the cached URL (the records keep their original URL)
+
         All parameters are wired out to the CLI and are documented there.
     """
-    def __init__(self, existing_warc_filenames, new_warc_filename, _logger, just_cache=False, download_params=None):
+    def __init__(self, existing_warc_filenames, new_warc_filename, _logger, just_cache=False, download_params=None,
+                 url_normalizer=None):
         self._logger = _logger
+        self._url_normalizer = url_normalizer
         # TODO raise to normal params
         if download_params is not None:
             strict_mode = download_params.pop('strict_mode', False)
             check_digest = download_params.pop('check_digest', False)
             allow_empty_warc = download_params.pop('allow_empty_warc', False)
+            self._revalidate_cache = download_params.pop('revalidate_cache', True)
         else:
             strict_mode = False
             check_digest = False
             allow_empty_warc = False
+            self._revalidate_cache = True
             download_params = {}
 
         self.url_index = set()
+        self._cached_url_forms = {}  # Canonical form -> the URL of the cached record (if they differ)
+        aliases = {}
         info_record_data = None
         if existing_warc_filenames is not None:  # Setup the given existing warc archive file as cache
             if isinstance(existing_warc_filenames, str):
@@ -113,28 +216,155 @@ class WarcCachingDownloader:
                 cached_downloads = WarcReader(ex_warc_filename, _logger, strict_mode, check_digest, allow_empty_warc)
                 self._cached_downloads.append(cached_downloads)
                 self.url_index |= cached_downloads.url_index
+                aliases.update(cached_downloads.aliases)
                 # The last, top priority info record is used
                 info_record_data = cached_downloads.info_record_data
+            if url_normalizer is not None:  # The cached URLs can be found by their canonical form (the last wins)
+                for cached_downloads in self._cached_downloads:
+                    for url in cached_downloads.url_index:
+                        canonical_url = url_normalizer.canonicalize(url)
+                        if canonical_url != url and canonical_url not in self.url_index:
+                            self._cached_url_forms[canonical_url] = url
 
         if just_cache:
             self._new_downloads = WarcDummyDownloader()
         else:
             self._new_downloads = WarcDownloader(new_warc_filename, _logger, info_record_data, **download_params)
+        # Alias URL -> the URL of its record (shared with the downloader which adds the newly downloaded aliases)
+        self.aliases = self._new_downloads.aliases
+        self.aliases.update(aliases)
+        self._new_downloads.cached_urls = self.url_index
+        if url_normalizer is not None:
+            self.bad_urls.update({self.normalize_url(url) for url in self.bad_urls})
+
+    def normalize_url(self, url):
+        """
+            The canonical form of the URL (memoized, see UrlNormalizer) or the URL of the cached record with the same
+             canonical form. Without url_normalizer the URL is returned as is
+        """
+        if self._url_normalizer is None:
+            return url
+        url = self._url_normalizer.normalize(url)
+        return self._cached_url_forms.get(url, url)
+
+    def download_url(self, url, ignore_cache=False, return_warc_records_wo_writing=False, decode=True,
+                     route_key=None):
+        url = self.normalize_url(url)
+        done, content = self._download_url_from_cache(url, ignore_cache, return_warc_records_wo_writing, decode,
+                                                      route_key)
+        if done:
+            return content
+
+        # 5) Really download the URL! (url not in cached_content or cached_content is ignored)
+        #    Still check if the URL is already downloaded or failed recently (without network access)!
+        if self._is_backing_off_logged(url):
+            return None
+        ret = self._new_downloads.download_url(url, return_warc_records_wo_writing, decode, route_key, content)
+        if ret is None and url in self.aliases:  # 6) Redirected to an URL which already has a record
+            _, ret = self._download_url_from_cache(url, False, return_warc_records_wo_writing, decode, route_key)
+        elif ret is None and content is not None:  # 7) The revalidation failed: keep the cached copy
+            ret = self._keep_cached_copy(url, content, route_key)
+        return ret
+
+    async def download_url_async(self, url, ignore_cache=False, return_warc_records_wo_writing=False, decode=True,
+                                 route_key=None):
+        """The same as download_url(), but the download runs concurrently with the other ones (see WarcDownloader)"""
+        url = self.normalize_url(url)
+        done, content = self._download_url_from_cache(url, ignore_cache, return_warc_records_wo_writing, decode,
+                                                      route_key)
+        if done:
+            return content
 
-    def download_url(self, url, ignore_cache=False, return_warc_records_wo_writing=False, decode=True):
+        # 5) Really download the URL! (url not in cached_content or cached_content is ignored)
+        #    Still check if the URL is already downloaded or failed recently (without network access)!
+        if self._is_backing_off_logged(url):
+            return None
+        ret = await self._new_downloads.download_url_async(url, return_warc_records_wo_writing, decode, route_key,
+                                                           content)
+        if ret is None and url in self.aliases:  # 6) Redirected to an URL which already has a record
+            _, ret = self._download_url_from_cache(url, False, return_warc_records_wo_writing, decode, route_key)
+        elif ret is None and content is not None:  # 7) The revalidation failed: keep the cached copy
+            ret = self._keep_cached_copy(url, content, route_key)
+        return ret
+
+    def download_many(self, urls, ignore_cache=False, decode=True, route_key=None, max_pending=100):
+        """
+            Download many URLs and yield (URL, content) pairs as they are finished (the URLs are the unique canonical
+             ones, see normalize_url(), the content is None if the download failed, see download_url()):
+             1) the cache hits first in the order of their offsets in the cached WARC files (sequential reading)
+             2) the rest concurrently with download_url_async() (within the same limits, e.g. max_in_flight and
+                 the rate limits) in the order of completion. At most max_pending downloads are started ahead of
+                 the consumer of the generator (backpressure)
+            The records are written and the URLs are bookkept the same way as with download_url()
+            It runs its own event loop, therefore it can not be called from a coroutine (use download_url_async())
+        """
+        if max_pending < 1:
+            raise ValueError(f'max_pending ({max_pending}) must be positive!')
+        cached, missing = [], []
+        for url in dict.fromkeys(self.normalize_url(url) for url in urls):  # Unique, keep order
+            record_url = url if url in self.url_index else self.aliases.get(url)
+            if not ignore_cache and record_url in self.url_index and record_url not in self.good_urls:
+                cache, (reqv_offset, _), _ = self.get_records_offset(record_url)
+                cached.append((self._cached_downloads.index(cache), reqv_offset, url))
+            else:
+                missing.append(url)
+
+        for _, _, url in sorted(cached):
+            yield url, self.download_url(url, ignore_cache, decode=decode, route_key=route_key)
+        if len(missing) > 0:
+            yield from self._download_many_concurrently(missing, ignore_cache, decode, route_key, max_pending)
+
+    def _download_many_concurrently(self, urls, ignore_cache, decode, route_key, max_pending):
+        async def download_pair(url):
+            return url, await self.download_url_async(url, ignore_cache, decode=decode, route_key=route_key)
+
+        loop = new_event_loop()
+        urls_it = iter(urls)
+        pending = set()
+        try:
+            while True:
+                # The event loop runs (and writes the records) only while the consumer waits for the next pair
+                for url in islice(urls_it, max_pending - len(pending)):
+                    pending.add(loop.create_task(download_pair(url)))
+                if len(pending) == 0:
+                    break
+                done, pending = loop.run_until_complete(wait(pending, return_when=FIRST_COMPLETED))
+                for task in done:
+                    yield task.result()
+        finally:  # E.g. the consumer stopped early: the unfinished downloads are not written nor bookkept
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                loop.run_until_complete(gather(*pending, return_exceptions=True))
+            loop.close()
+
+    def _download_url_from_cache(self, url, ignore_cache, return_warc_records_wo_writing, decode, route_key):
+        """
+            Returns (True, content) if the URL is handled without downloading or (False, cached copy) if it must be
+             downloaded. The cached copy (response record, content) or None is revalidated with a conditional request
+        """
         # 1) Check if the URL is explicitly marked as bad...
         if url in self._new_downloads.bad_urls:
             self._logger.log('WARNING', url, 'Skipping URL explicitly marked as bad!', sep='\t')
-            return None
+            return True, None
         # 2) If the URL is present in the newly created WARC file warn and skip the URL!
         elif url in self._new_downloads.good_urls:
             # 3) throw error and return None!
             self._logger.log('ERROR', 'Not processing URL, because it is already present in the WARC archive:', url)
-            return None
+            return True, None
         # 3) Check if the URL presents in the cached_content...
         elif url in self.url_index:
             # 3a) ...retrieve it! (from the last source WARC where the URL is found in)
             cache, reqv, resp = self.get_records_offset(url)
+            if ignore_cache and not return_warc_records_wo_writing:
+                # 3a') Download it only if it is changed since it was cached (the retry logic of the callers
+                #  which want the records for themselves uses ignore_cache to get a fresh copy in any case)
+                if self._revalidate_cache:
+                    self._logger.log('INFO', 'Revalidating cached_content for URL:', url)
+                    return False, (cache.get_record(resp[0]), cache.download_url(url, decode))
+                # 3a'') Or download it unconditionally (the cached records are not written)
+                self._logger.log('INFO', 'Ignoring cached_content for URL:', url)
+                return False, None
             # 3b) Get content even if the URL is a duplicate, because ignore_cache knows better what to do with it
             cached_content = cache.download_url(url, decode)
             # 3c) Decide to return the records with the content XOR write the records and return the content only
@@ -142,7 +372,19 @@ class WarcCachingDownloader:
                 # E.g. for separate, optional writing with write_records_for_url() in a retry logic
                 cached_content = ((cache, reqv, resp), cached_content)
             else:
-                self._new_downloads.write_records_for_url(url, (cache, reqv, resp))
+                self._new_downloads.write_records_for_url(url, (cache, reqv, resp), route_key)
+        # 3') Serve the aliases (redirected URLs) from the record of the URL they are redirected to
+        #  (the callers which want the records for themselves or a fresh copy download them again)
+        elif url in self.aliases and not ignore_cache and not return_warc_records_wo_writing:
+            canonical_url = self.aliases[url]
+            if canonical_url in self._new_downloads.good_urls:
+                self._logger.log('INFO', url, f'Not processing URL, because it redirects to {canonical_url}'
+                                              f' which is already present in the WARC archive', sep='\t')
+                return True, None
+            self._logger.log('INFO', url, f'Serving the cached record of {canonical_url} (redirected URL)', sep='\t')
+            cache, reqv, resp = self.get_records_offset(canonical_url)
+            self._new_downloads.write_records_for_url(canonical_url, (cache, reqv, resp), route_key)
+            return True, cache.download_url(canonical_url, decode)
         else:
             cached_content = None
 
@@ -150,17 +392,76 @@ class WarcCachingDownloader:
         if cached_content is not None:
             if not ignore_cache:
                 # 4a) and we do not explicitly ignore the cache, return the cached content!
-                return cached_content
+                return True, cached_content
             else:
                 # 4b) Log that we ignored the cached_content and do noting!
                 self._logger.log('INFO', 'Ignoring cached_content for URL:', url)
 
-        # 5) Really download the URL! (url not in cached_content or cached_content is ignored)
-        #    Still check if the URL is already downloaded!
-        return self._new_downloads.download_url(url, return_warc_records_wo_writing, decode)
+        return False, None
+
+    def _keep_cached_copy(self, url, revalidate, route_key):
+        """The revalidating request failed (e.g. network error or HTTP 5xx): write the cached records instead"""
+        if url in self._new_downloads.good_urls:
+            return None
+        if self.defers_retries:  # The cached copy is as good as a retry
+            self._new_downloads.retry_scheduler.unschedule(url)
+            self._new_downloads.retry_scheduler.forget(url)
+        self._logger.log('WARNING', url, 'Revalidation failed, keeping the cached copy', sep='\t')
+        self._new_downloads.write_records_for_url(url, self.get_records_offset(url), route_key)
+        return revalidate[1]
+
+    def _backoff_wait(self, url):
+        failure_store = self._new_downloads.failure_store
+        if failure_store is None:
+            return None
+        return failure_store.check(url)
+
+    def _is_backing_off_logged(self, url):
+        wait = self._backoff_wait(url)
+        if wait is None:
+            return False
+        if wait == inf:
+            self._logger.log('INFO', url, 'Not downloading URL, because it is permanently bad in the failure store',
+                             sep='\t')
+        else:
+            self._logger.log('INFO', url, f'Not downloading URL, because it failed recently (can be retried in'
+                                          f' {wait / 3600:.2f} hours)', sep='\t')
+        return True
+
+    def is_backing_off(self, url):
+        """The download of the URL failed in a previous try and it must not be retried yet (see FailureStore)"""
+        url = self.normalize_url(url)
+        return url not in self.url_index and self._backoff_wait(url) is not None
+
+    def write_records_for_url(self, url, rec, route_key=None):
+        self._new_downloads.write_records_for_url(self.normalize_url(url), rec, route_key)
+
+    @property
+    def defers_retries(self):
+        """Failed downloads are retried later by the RetryScheduler (see retry_policy) instead of immediately"""
+        return self._new_downloads.retry_scheduler is not None
+
+    def is_retry_scheduled(self, url):
+        """The download of the URL failed, but it is scheduled for retrying (download_url() returned None)"""
+        return self.defers_retries and self._new_downloads.retry_scheduler.is_scheduled(self.normalize_url(url))
+
+    def due_retries(self):
+        """The URLs which are due for retrying now (does not block)"""
+        if not self.defers_retries:
+            return []
+        return self._new_downloads.retry_scheduler.due_urls()
 
-    def write_records_for_url(self, url, rec):
-        self._new_downloads.write_records_for_url(url, rec)
+    def wait_for_retries(self):
+        """Yield all the remaining URLs scheduled for retrying by sleeping until they are due"""
+        if self.defers_retries:
+            yield from self._new_downloads.retry_scheduler.wait_for_due_urls()
+
+    def wait_for_retry(self, url):
+        """Sleep until the retry of the URL is due (the other URLs stay scheduled), False if it is not scheduled"""
+        return self.defers_retries and self._new_downloads.retry_scheduler.wait_for(self.normalize_url(url))
+
+    def close(self):
+        self._new_downloads.close()
 
     def get_records_offset(self, url):
         for cache in reversed(self._cached_downloads):
@@ -186,6 +487,10 @@ class WarcCachingDownloader:
     def good_urls(self):  # Ready-only property for shortcut
         return self._new_downloads.good_urls
 
+    @property
+    def rejected_urls(self):  # Ready-only property for shortcut
+        return self._new_downloads.rejected_urls
+
 
 class WarcDummyDownloader:
     """
@@ -194,11 +499,19 @@ class WarcDummyDownloader:
     def __init__(self, *_, **__):
         self.bad_urls = set()
         self.good_urls = set()
+        self.rejected_urls = set()
+        self.aliases = {}
+        self.retry_scheduler = None
+        self.failure_store = None
 
     @staticmethod
     def download_url(*_, **__):
         return None
 
+    @staticmethod
+    async def download_url_async(*_, **__):
+        return None
+
     @staticmethod
     def write_records_for_url(*_, **__):
         return None
@@ -211,20 +524,39 @@ class WarcDummyDownloader:
     def get_records(*_, **__):
         return None
 
+    @staticmethod
+    def close(*_, **__):
+        return None
+
 class WarcDownloader:
     """
         Download URL with HTTP GET, save to a WARC file and return the decoded text
+
+        download_url() blocks until the download is finished. download_url_async() is the asyncio engine:
+         at most max_in_flight downloads (and at most max_per_host downloads for the same host) run concurrently
+         in worker threads sharing the session, rate limit and URL bookkeeping, and the records are written
+         on the event loop thread in the order of completion.
     """
     def __init__(self, expected_filename, _logger, warcinfo_record_data=None, program_name='WebArticleCurator',
                  user_agent=None, overwrite_warc=True, err_threshold=10, known_bad_urls=None,
                  max_no_of_calls_in_period=2, limit_period=1, proxy_url=None, allow_cookies=False, verify_request=True,
-                 stay_offline=False, max_retries=3):
+                 stay_offline=False, max_retries=3, durability=None, max_in_flight=4, max_per_host=2,
+                 rate_limit_burst=None, rate_limiter=None, rate_controller=None, retry_policy=None,
+                 host_pause=60.0, max_host_pause=3600.0, compressed_transfer=True, pool_maxsize=10,
+                 pool_connections=100, keep_alive=True, dns_cache_ttl=300.0, http2=False, connect_timeout=10.0,
+                 read_timeout=30.0, total_timeout=300.0, slow_host_threshold=10.0, max_body_size=None,
+                 allowed_content_types=None, resume_partial=True, partial_dir=None, proxy_pool=None,
+                 byte_rate_limiter=None, charset_detector=None, failure_store=None):
         # Store variables
         self._logger = _logger
-        self._req_headers = {'Accept-Encoding': 'identity', 'User-agent': user_agent}
-        self._error_count = 0
-        self._error_threshold = err_threshold  # Set the error threshold which cause aborting to prevent ban
+        # The payload is stored compressed as transferred (with its Content-Encoding header) and decoded for the text
+        accept_encoding = ACCEPT_ENCODING if compressed_transfer else 'identity'
+        self._req_headers = {'Accept-Encoding': accept_encoding, 'User-agent': user_agent}
+        # Pause the hosts after err_threshold consecutive errors to prevent ban (the other hosts are not affected)
+        self._circuit_breakers = HostCircuitBreakers(err_threshold, host_pause, max_host_pause)
         self._max_retries = max_retries
+        # With a RetryPolicy failed URLs are retried later (the caller continues with other URLs meanwhile)
+        self.retry_scheduler = RetryScheduler(retry_policy) if retry_policy is not None else None
 
         # Setup download function
         if not stay_offline:
@@ -238,72 +570,416 @@ class WarcDownloader:
         else:
             self.bad_urls = set()
 
-        self.good_urls = set()
+        # The URLs failing in the previous runs are skipped for a while or for good (see FailureStore)
+        self.failure_store = failure_store
+        if failure_store is not None:
+            self.bad_urls |= failure_store.permanently_bad_urls()
 
-        # Setup target file handle
-        filename = self._set_target_filename(expected_filename, overwrite_warc)
-        self._logger.log('INFO', 'Creating archivefile:', filename)
-        self._output_file = open(filename, 'wb')
+        self.good_urls = set()
+        # Alias URL -> the URL of its record: the redirects to an URL already downloaded (or in cached_urls, set by
+        #  WarcCachingDownloader) are not downloaded again (see WARC-X-Redirect-Chain)
+        self.aliases = {}
+        self.cached_urls = frozenset()
+
+        # Setup the asyncio engine (the worker threads and the limits are created on first use)
+        if max_in_flight < 1 or max_per_host < 1:
+            raise ValueError(f'max_in_flight ({max_in_flight}) and max_per_host ({max_per_host}) must be positive!')
+        self._max_in_flight = max_in_flight
+        self._max_per_host = max_per_host
+        # Never wait forever: (connect, read) timeouts for the requests and a time budget for the whole response
+        self._timeout = (connect_timeout, read_timeout)
+        self._total_timeout = total_timeout
+        # Downloads from the hosts with degraded tail latency run one at a time (see download_url_async())
+        self._slow_hosts = SlowHostDetector(slow_host_threshold)
+        # Reject the unwanted responses (e.g. videos, large attachments) by their headers or abort them while reading:
+        #  max_body_size in bytes (None: no limit) and the allowed media types (e.g. text/html, text/*, None: any)
+        if max_body_size is not None and max_body_size < 1:
+            raise ValueError(f'max_body_size ({max_body_size}) must be positive or None!')
+        self._max_body_size = max_body_size
+        if allowed_content_types is not None:
+            allowed_content_types = frozenset(content_type.strip().lower() for content_type in allowed_content_types)
+        self._allowed_content_types = allowed_content_types
+        self.rejected_urls = set()
+        # Interrupted downloads are resumed with Range requests if the server supports it (kept in partial_dir)
+        self._partials = PartialDownloads(partial_dir) if resume_partial else None
+        self._executor = None
+        self._async_limits = WeakKeyDictionary()  # Event loop -> (in-flight window, per-host semaphores)
+        self._in_flight_urls = set()
 
         self._session = Session()  # Setup session for speeding up downloads
+        self._thread_local = local()  # The concurrent downloads use a copy of it per thread (see _get_session())
+        if http2:  # Optional HTTP/2 transport multiplexing the requests over one connection per host
+            self._adapter = Http2Adapter(pool_maxsize)
+        else:  # Keep pool_maxsize connections alive per host and cache the DNS lookups (0 or None: no DNS cache)
+            dns_cache = DNSCache(dns_cache_ttl) if dns_cache_ttl else None
+            self._adapter = PooledHTTPAdapter(pool_connections, pool_maxsize, keep_alive, dns_cache)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        if proxy_url is not None and proxy_pool is not None:
+            raise ValueError('proxy_url and proxy_pool are mutually exclusive!')
         if proxy_url is not None:  # Set socks proxy if provided
             self._session.proxies['http'] = proxy_url
             self._session.proxies['https'] = proxy_url
+        self._proxy_pool = proxy_pool  # Or spread the requests over a ProxyPool
 
         self._allow_cookies = allow_cookies
         self._verify_request = verify_request
         if not self._verify_request:
             disable_warnings(InsecureRequestWarning)
 
-        # Setup rate limiting to prevent hammering the server
-        self._requests_get = sleep_and_retry(limits(calls=max_no_of_calls_in_period,
-                                                    period=limit_period)(self._http_get_w_cookie_handling))
-
-        self._writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
+        # Setup rate limiting to prevent hammering the server: max_no_of_calls_in_period / limit_period requests
+        #  per second and per host with bursts of rate_limit_burst requests (the token buckets are shared by all
+        #  downloaders in the process, e.g. by the archive and the article crawler)
+        if rate_limiter is None:
+            rate_limiter = shared_rate_limiter
+        if rate_limit_burst is None:  # At least one request must fit into the bucket (e.g. 0.5 calls per period)
+            rate_limit_burst = max(1, ceil(max_no_of_calls_in_period))
+        self._rate_limiter = rate_limiter
+        self._rate = max_no_of_calls_in_period / limit_period
+        self._rate_limit_burst = rate_limit_burst
+        self._rate_limit_wait = 0.0
+        self._rate_controller = rate_controller  # Optionally adapt the rate to the latency and errors (AIMD)
+        self._byte_rate_limiter = byte_rate_limiter  # Optionally pace the reading of the bodies (ByteRateLimiter)
+        self._byte_rate_wait = 0.0
+        # BOM, <meta charset>, UTF-8 and chardet on a sample, remembered per site section (see CharsetDetector)
+        if charset_detector is None:
+            charset_detector = CharsetDetector()
+        self._charset_detector = charset_detector
+        self._requests_get = self._rate_limited_http_get
+
+        self._record_builder = RecordBuilder(warc_version='WARC/1.1')
         if warcinfo_record_data is None:  # Or use the parsed else custom headers will not be copied
-            # INFO RECORD
-            # Some custom information about the warc writer program and its settings
-            warcinfo_record_data = {'software': program_name, 'arguments': ' '.join(sys.argv[1:]),
-                                    'format': 'WARC File Format 1.1',
-                                    'conformsTo': 'http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1-1_latestdraft.pdf'}
-        info_record = self._writer.create_warcinfo_record(filename, warcinfo_record_data)
-        self._writer.write_record(info_record)
+            warcinfo_record_data = default_warcinfo_record_data(program_name)
 
-    @staticmethod
-    def _set_target_filename(filename, overwrite_warc):
-        if not overwrite_warc:  # Find out next nonexisting warc filename
-            num = 0
-            while Path(filename).exists():
-                filename2, ext = filename.stem, filename.suffix
-                # Should be filename.warc.gz
-                if filename.suffix == '.gz' and filename2.endswith('.warc'):
-                    # Should be filename.warc
-                    filename2, ext2 = filename2.stem, filename2.suffix
-                    ext = ext2 + ext  # Should be .warc.gz
-
-                filename = f'{filename2}-{num:05d}{ext}'
-                num += 1
-
-        return filename
+        # Setup target file handle(s): a single filename or a routing function to select the target for each record
+        if callable(expected_filename):
+            route_fun = expected_filename
+        else:
+            def route_fun(*_):
+                return expected_filename
+        self._router = WarcWriterRouter(route_fun, _logger, warcinfo_record_data, overwrite_warc, durability)
+        if not callable(expected_filename):
+            self._router.get_writer(expected_filename)  # The single target file is created in advance
 
     def __del__(self):
-        if hasattr(self, '_output_file'):  # If the program opened a file, then it should gracefully close it on exit!
-            self._output_file.close()
+        if hasattr(self, '_router'):  # If the program opened a file, then it should gracefully close it on exit!
+            self._router.close()
+
+    def close(self):
+        """Write out the buffered records and close the output WARC file(s)"""
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._logger.log('INFO', f'Waited {self._rate_limit_wait:.2f} seconds for the rate limiter')
+        if self._byte_rate_limiter is not None:
+            self._logger.log('INFO', f'Waited {self._byte_rate_wait:.2f} seconds for the byte rate limiter')
+        if isinstance(self._adapter, PooledHTTPAdapter):
+            for host, (new_conns, reused_conns, tls_handshakes) in self._adapter.stats.stats().items():
+                self._logger.log('INFO', 'Connections', host, f'{new_conns} new', f'{reused_conns} reused',
+                                 f'{tls_handshakes} TLS handshakes', sep='\t')
+        self._adapter.close()
+        for host, (n, median, tail, is_slow) in self._slow_hosts.stats().items():
+            self._logger.log('WARNING' if is_slow else 'INFO', 'Latency', host, f'{n} responses',
+                             f'median {median:.2f}s', f'p{self._slow_hosts.pct} {tail:.2f}s',
+                             'slow' if is_slow else 'normal', sep='\t')
+        for host, state in self._circuit_breakers.states().items():
+            self._logger.log('WARNING', 'Circuit breaker', host, f'{state} at the end of the session', sep='\t')
+        if self._proxy_pool is not None:
+            for proxy_url, (requests, failures, state) in self._proxy_pool.stats().items():
+                self._logger.log('INFO', 'Proxy', redact_proxy_url(proxy_url), f'{requests} requests',
+                                 f'{failures} failures', state, sep='\t')
+        if len(self.rejected_urls) > 0:
+            self._logger.log('INFO', f'Rejected {len(self.rejected_urls)} responses (size or content type)')
+        if self.failure_store is not None:
+            backing_off, permanently_bad = self.failure_store.stats()
+            self._logger.log('INFO', f'Failure store: {backing_off} URLs waiting for retry, {permanently_bad}'
+                                     f' permanently bad URLs')
+        self._router.close()
+
+    def _get_async_limits(self, host):
+        # asyncio primitives must be created inside the event loop which uses them
+        loop = get_running_loop()
+        limits_for_loop = self._async_limits.get(loop)
+        if limits_for_loop is None:
+            limits_for_loop = (Semaphore(self._max_in_flight), defaultdict(lambda: Semaphore(self._max_per_host)),
+                               defaultdict(lambda: Semaphore(1)), Semaphore(self._max_in_flight))
+            self._async_limits[loop] = limits_for_loop
+        in_flight_window, host_semaphores, slow_host_semaphores, no_limit = limits_for_loop
+        # The in-flight window already limits the downloads to the normal hosts
+        slow_host_semaphore = slow_host_semaphores[host] if self._slow_hosts.is_slow(host) else no_limit
+        return loop, in_flight_window, host_semaphores[host], slow_host_semaphore
+
+    async def download_url_async(self, url, return_warc_records_wo_writing=False, decode=True, route_key=None,
+                                 revalidate=None):
+        if url in self._in_flight_urls:  # This should not happen!
+            self._logger.log('ERROR', 'Not downloading URL, because it is already being downloaded:', url)
+            return None
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self._max_in_flight, thread_name_prefix='WarcDownloader')
+        _, in_flight_window, host_semaphore, slow_host_semaphore = self._get_async_limits(urlparse(url).netloc)
+        self._in_flight_urls.add(url)
+        future = None
+        try:
+            async with in_flight_window, host_semaphore, slow_host_semaphore:
+                # Only the network I/O runs in the worker thread, records are not written there
+                future = self._executor.submit(self.download_url, url, True, decode, None, revalidate)
+                ret = await wrap_future(future)
+        finally:
+            if future is not None and not future.done() and not future.cancel():
+                # Cancelled (e.g. download_many() is closed early), but the worker thread can not be interrupted:
+                #  the URL is in flight until the thread finishes
+                future.add_done_callback(lambda _: self._in_flight_urls.discard(url))
+            else:
+                self._in_flight_urls.discard(url)
+
+        if ret is not None and not return_warc_records_wo_writing:
+            rec, ret = ret
+            self.write_records_for_url(url, rec, route_key)
+
+        return ret
+
+    def _rate_limited_http_get(self, url, *args, **kwargs):
+        host = urlparse(url).netloc
+        self._rate_limit_wait += self._rate_limiter.acquire(host, self._rate, self._rate_limit_burst)
+        if self._proxy_pool is not None:
+            return self._proxied_http_get(host, url, *args, **kwargs)
+        start = monotonic()
+        try:
+            resp = self._http_get_w_cookie_handling(url, *args, **kwargs)
+        except RequestException:
+            if self._rate_controller is not None:
+                self._rate_controller.update(host, monotonic() - start, None, self._logger)
+            raise
+        if self._rate_controller is not None:
+            self._rate_controller.update(host, monotonic() - start, resp.status_code, self._logger)
+        return resp
+
+    def _proxied_http_get(self, host, url, *args, **kwargs):
+        """Send the request through a proxy of the pool and track the health of the proxy"""
+        proxy_url = self._proxy_pool.acquire()
+        kwargs['proxies'] = {'http': proxy_url, 'https': proxy_url}
+        start = monotonic()
+        proxy_ok = True  # The other errors (e.g. invalid URL) are not the fault of the proxy
+        try:
+            resp = self._http_get_w_cookie_handling(url, *args, **kwargs)
+        except RequestException as err:
+            # Connection errors and timeouts are blamed on the proxy as it can not be told who is at fault
+            proxy_ok = not isinstance(err, (RequestsConnectionError, Timeout))
+            if self._rate_controller is not None:
+                self._rate_controller.update(host, monotonic() - start, None, self._logger)
+            raise
+        finally:  # Always give back the proxy
+            self._log_proxy_state(proxy_url, self._proxy_pool.release(proxy_url, proxy_ok))
+        if self._rate_controller is not None:
+            self._rate_controller.update(host, monotonic() - start, resp.status_code, self._logger)
+        resp.proxy_url = redact_proxy_url(proxy_url)  # To be recorded in the WARC file
+        return resp
+
+    def _log_proxy_state(self, proxy_url, state):
+        if state == OPEN:
+            self._logger.log('WARNING', 'Proxy', redact_proxy_url(proxy_url), 'out of rotation',
+                             f'for {self._proxy_pool.open_timeout(proxy_url):.2f} seconds', sep='\t')
+        elif state is not None:
+            self._logger.log('INFO', 'Proxy', redact_proxy_url(proxy_url), 'back in rotation', sep='\t')
+
+    def _get_session(self):
+        """
+            The session of the current thread: the copies share the connection pools, the proxy settings
+             and the cookies if they are allowed, else the cookies purged by one thread can not leak into
+             the requests of the others
+        """
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            session.proxies.update(self._session.proxies)
+            if self._allow_cookies:
+                session.cookies = self._session.cookies  # The cookie jar is thread-safe
+            self._thread_local.session = session
+        return session
 
     def _http_get_w_cookie_handling(self, *args, **kwargs):
         """
             Extend requests.get with optional cookie purging
         """
+        session = self._get_session()
         if not self._allow_cookies:
-            self._session.cookies.clear()
-        return self._session.get(*args, **kwargs)
+            session.cookies.clear()
+        return session.get(*args, **kwargs)
 
-    def _handle_request_exception(self, url, msg):
+    def _handle_request_exception(self, url, msg, host_failure=True):
+        """
+            Log the failure and count it for the circuit breaker of the host if it is the fault of the host
+             (network errors, timeouts, HTTP 429 and 5xx) and not of the URL (e.g. 404, invalid content)
+        """
         self._logger.log('WARNING', url, msg, sep='\t')
+        if not host_failure:
+            return
+
+        host = urlparse(url).netloc
+        if self._circuit_breakers.record_failure(host) == OPEN:
+            self._logger.log('WARNING', 'Circuit breaker', host, 'open', f'Pausing the host for'
+                                        f' {self._circuit_breakers.open_timeout(host):.2f} seconds', sep='\t')
+
+    def _host_paused(self, url, wait):
+        """Postpone the URL if the retries are deferred (returns True) else sleep until the probe is allowed"""
+        if self.retry_scheduler is not None:  # Does not count as a try
+            self.retry_scheduler.postpone(url, wait)
+            self._logger.log('INFO', url, f'Host is paused by the circuit breaker, retry scheduled in {wait:.2f}'
+                                          f' seconds', sep='\t')
+            return True
+        self._logger.log('INFO', url, f'Host is paused by the circuit breaker, waiting {wait:.2f} seconds',
+                         sep='\t')
+        sleep(wait)
+        return False
 
-        self._error_count += 1
-        if self._error_count >= self._error_threshold:
-            raise NameError('Too many error happened! Threshold exceeded! See log for details!')
+    @staticmethod
+    def _is_host_failure(status_code):
+        return status_code == 429 or status_code >= 500
+
+    def _check_headers(self, resp):
+        """Raise ResponseRejected if the headers show that the response is too large or has unwanted content type"""
+        if self._allowed_content_types is not None:
+            content_type_header = resp.headers.get('Content-Type')
+            if content_type_header is not None:  # Without Content-Type the response can not be judged
+                media_type = _parse_content_type_header(content_type_header)[0].lower()
+                if media_type not in self._allowed_content_types and \
+                        f'{media_type.split("/", 1)[0]}/*' not in self._allowed_content_types:
+                    raise ResponseRejected(f'Content type ({media_type}) is not allowed')
+        if self._max_body_size is not None:
+            content_length = resp.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > self._max_body_size:
+                raise ResponseRejected(f'Content-Length ({content_length}) exceeds the size limit'
+                                       f' ({self._max_body_size} bytes)')
+
+    def _read_body(self, resp, url, chunks):
+        """
+            Read the raw payload in chunks within the time budget of the response (total_timeout)
+             and the size limit (max_body_size, the stream is aborted when exceeded)
+            The chunks are appended to the list (which may start with the already downloaded part of the payload)
+             to keep them when the download is interrupted
+            The reading is paced by the byte rate limiter if any (the time spent waiting for it does not count
+             in the time budget and the latency of the host)
+        """
+        elapsed = resp.elapsed.total_seconds()  # Until the headers are parsed
+        start = monotonic()
+        deadline = start + self._total_timeout - elapsed
+        read1 = getattr(resp.raw, 'read1', resp.raw.read)  # Return as soon as some data arrives
+        host = urlparse(url).netloc
+        size = sum(len(chunk) for chunk in chunks)
+        shaped = 0.0  # Seconds waited for the byte rate limiter
+        while True:
+            chunk = read1(64 * 1024)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if self._max_body_size is not None and size > self._max_body_size:
+                resp.close()
+                raise ResponseRejected(f'Body exceeds the size limit ({self._max_body_size} bytes)')
+            if monotonic() - shaped > deadline:
+                resp.close()
+                self._update_latency(url, elapsed + monotonic() - start - shaped)
+                raise ReadTimeoutError(None, url, f'Total timeout ({self._total_timeout} seconds) exceeded!')
+            if self._byte_rate_limiter is not None:
+                shaped += self._byte_rate_limiter.consume(host, len(chunk))
+
+        self._byte_rate_wait += shaped
+        self._update_latency(url, elapsed + monotonic() - start - shaped)
+        return b''.join(chunks)
+
+    def _reject_response(self, url, resp, reason):
+        # The host works well: rejections are not counted as errors by the circuit breaker and are not retried
+        resp.close()
+        self.rejected_urls.add(url)
+        if self.retry_scheduler is not None:
+            self.retry_scheduler.forget(url)
+        self._logger.log('WARNING', url, f'Response rejected: {reason} \n\n'
+                                         f' The program ignores it and jumps to the next one.', sep='\t')
+        return None
+
+    def _update_latency(self, url, latency):
+        host = urlparse(url).netloc
+        is_slow = self._slow_hosts.update(host, latency)
+        if is_slow is not None:
+            self._logger.log('WARNING' if is_slow else 'INFO', 'Slow host', host,
+                             'detected' if is_slow else 'recovered', sep='\t')
+
+    @staticmethod
+    def _is_valid_resumption(resp, partial, size):
+        content_range = parse_content_range(resp.headers.get('Content-Range'))
+        return resp.status_code == 206 and content_range is not None and content_range[0] == size and \
+            content_range[2] == partial['length']
+
+    def _resume_download(self, url, url_reparsed, partial, size):
+        """Request the rest of the interrupted payload from byte size, return the response or None on failure"""
+        headers = dict(self._req_headers, **{'Range': f'bytes={size}-', 'If-Range': partial['validator']})
+        try:
+            resp = self._requests_get(url_reparsed, headers=headers, stream=True, verify=self._verify_request,
+                                      timeout=self._timeout)
+        except RequestException as err:
+            self._handle_request_exception(url, f'RequestException happened during resuming the download: {err}')
+            return None
+        if not self._is_valid_resumption(resp, partial, size):
+            resp.close()
+            if resp.status_code == 416:  # The stored part does not fit the payload: the next try starts over
+                self._partials.remove(url)
+            self._handle_request_exception(url, f'Resuming the download failed: {resp.status_code} {resp.reason}'
+                                                f' (Content-Range: {resp.headers.get("Content-Range")})',
+                                           self._is_host_failure(resp.status_code))
+            return None
+        self._logger.log('INFO', url, f'Resuming the download from byte {size}', sep='\t')
+        return resp
+
+    def _conditional_request_headers(self, cached_resp_record):
+        """Returns the cached response record and the request headers extended with its validators if any"""
+        cached_http_headers = cached_resp_record.http_headers
+        validators = {}
+        etag = cached_http_headers.get_header('ETag')
+        if etag is not None:
+            validators['If-None-Match'] = etag
+        last_modified = cached_http_headers.get_header('Last-Modified')
+        if last_modified is not None:
+            validators['If-Modified-Since'] = last_modified
+        if len(validators) == 0 or cached_resp_record.rec_headers.get_header('WARC-Payload-Digest') is None:
+            return None, self._req_headers  # Can not be revalidated, download it unconditionally
+        return cached_resp_record, dict(self._req_headers, **validators)
+
+    def _record_failure(self, url, status):
+        """Note the failed download (the status code or the error) in the failure store if there is one"""
+        if self.failure_store is not None and self.failure_store.record_failure(url, status):
+            self.bad_urls.add(url)
+            self._logger.log('WARNING', url, f'Marked as permanently bad after repeated failures (last: {status})',
+                             sep='\t')
+
+    def _schedule_retry(self, url, failure, retry_after=None):
+        delay = self.retry_scheduler.schedule(url, retry_after)
+        if delay is None:  # The failure of the last try is already counted
+            if self._partials is not None:
+                self._partials.remove(url)
+            self._record_failure(url, failure)
+            self._logger.log('WARNING', url, 'Out of retries! \n\n The program ignores it and jumps to the next one.',
+                             sep='\t')
+        else:
+            self._logger.log('INFO', url, f'Retry scheduled in {delay:.2f} seconds', sep='\t')
+        return None
+
+    def _known_redirect_target(self, url, chain):
+        """The URL of the record (already downloaded or cached) of an URL in the redirect chain or None"""
+        for chain_url in chain:
+            target_url = self.aliases.get(chain_url, chain_url)
+            if target_url != url and (target_url in self.good_urls or target_url in self.cached_urls):
+                return target_url
+        return None
+
+    @staticmethod
+    def _proxy_header(resp, warc_headers_dict):
+        """Record the proxy which served the response if a ProxyPool is used"""
+        proxy_url = getattr(resp, 'proxy_url', None)
+        if proxy_url is not None:
+            warc_headers_dict['WARC-X-Proxy'] = proxy_url
+        return warc_headers_dict
 
     @staticmethod
     def _get_peer_name(resp):
@@ -314,6 +990,9 @@ class WarcDownloader:
         # So workaround to be compatible with windows:
         # https://stackoverflow.com/questions/22492484/how-do-i-get-the-ip-address-from-a-http-request-using-the-\
         # requests-library/22513161#22513161
+        peer_name = getattr(resp.raw, 'peer_name', None)  # Set by the HTTP/2 transport (see Http2RawResponse)
+        if peer_name is not None:
+            return peer_name
         try:
             peer_name = resp.raw._connection.sock.getpeername()[0]  # Must get peer_name before the content is read
         except AttributeError:  # On Windows there is no getpeername() Attribute of the class...
@@ -326,7 +1005,13 @@ class WarcDownloader:
     def _dummy_download_url(self, *_, **__):
         raise NotImplementedError
 
-    def _download_url(self, url, return_warc_records_wo_writing=False, decode=True):
+    def _download_url(self, url, return_warc_records_wo_writing=False, decode=True, route_key=None,
+                      revalidate=None):
+        """
+            revalidate: the cached copy (response record, content) to make a conditional request with the validators
+             of the record (ETag, Last-Modified). If the server answers with HTTP 304 Not Modified a revisit record
+             (referring to the cached response) is written instead of the response and the cached content is returned
+        """
         if url in self.bad_urls:
             self._logger.log('DEBUG', 'Not downloading known bad URL:', url)
             return None
@@ -342,41 +1027,104 @@ class WarcDownloader:
         if url != url_reparsed:
             self._logger.log('WARNING', f'URL ({url}) changed after reparsing:', url_reparsed)
 
-        # Try to resolve network errors with retries
-        for i in range(1, self._max_retries+1):
+        req_headers = self._req_headers
+        cached_resp_record = None
+        if revalidate is not None:
+            cached_resp_record, req_headers = self._conditional_request_headers(revalidate[0])
+        full_req_headers = req_headers
+        partial = None
+        if self._partials is not None and cached_resp_record is None:
+            partial = self._partials.load(url)
+            if partial is not None:  # Continue the interrupted download (If-Range: the rest or the whole if changed)
+                req_headers = dict(req_headers, **{'Range': f'bytes={partial["size"]}-',
+                                                   'If-Range': partial['validator']})
+
+        # Try to resolve network errors with immediate retries or schedule the retry for later
+        max_tries = self._max_retries if self.retry_scheduler is None else 1
+        failure = None
+        for i in range(1, max_tries+1):
+            wait = self._circuit_breakers.check(netloc)
+            while wait is not None:
+                if self._host_paused(url, wait):
+                    return None
+                wait = self._circuit_breakers.check(netloc)  # Another thread may be probing the host meanwhile
             try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
-                resp = self._requests_get(url_reparsed, headers=self._req_headers, stream=True,
-                                          verify=self._verify_request)
+                resp = self._requests_get(url_reparsed, headers=req_headers, stream=True,
+                                          verify=self._verify_request, timeout=self._timeout)
+                if resp.status_code == 416 and partial is not None:  # The stored part does not fit the payload
+                    resp.close()
+                    self._partials.remove(url)
+                    partial = None
+                    req_headers = full_req_headers
+                    self._logger.log('INFO', url, 'The interrupted download can not be resumed (416), downloading'
+                                                  ' the whole payload', sep='\t')
+                    resp = self._requests_get(url_reparsed, headers=req_headers, stream=True,
+                                              verify=self._verify_request, timeout=self._timeout)
             except RequestException as err:
                 self._handle_request_exception(url, f'RequestException happened during downloading: {err}')
+                failure = type(err).__name__
                 resp = None  # Retry if there is retries left...
             # UnicodeError is originated from idna codec error, LocationParseError is originated from URLlib3 error
             except (UnicodeError, LocationParseError) as err:
                 self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
-                                                    ' The program ignores it and jumps to the next one.')
+                                                    ' The program ignores it and jumps to the next one.', False)
+                self._circuit_breakers.release_probe(netloc)  # The request was not sent
                 return None
 
             if resp is not None:
-                if resp.status_code == 200:
+                # Any response which is not the fault of the host (e.g. 404) means it is alive: close the circuit
+                if not self._is_host_failure(resp.status_code) and \
+                        self._circuit_breakers.record_success(netloc) is not None:
+                    self._logger.log('INFO', 'Circuit breaker', netloc, 'closed', sep='\t')
+                if resp.status_code == 200 or (resp.status_code == 304 and cached_resp_record is not None) or \
+                        (resp.status_code == 206 and partial is not None):
                     break
+                elif self.retry_scheduler is not None and resp.status_code in RETRYABLE_STATUS_CODES:
+                    self._handle_request_exception(url, f'Downloading failed with status code: {resp.status_code} '
+                                                        f'{resp.reason}', self._is_host_failure(resp.status_code))
+                    return self._schedule_retry(url, resp.status_code,
+                                                parse_retry_after(resp.headers.get('Retry-After')))
                 else:  # Not HTTP 200 OK
                     self._handle_request_exception(url, f'Downloading failed with status code: {resp.status_code} '
                                                         f'{resp.reason}  \n\n'
-                                                        f' The program ignores it and jumps to the next one.')
+                                                        f' The program ignores it and jumps to the next one.',
+                                                   self._is_host_failure(resp.status_code))
+                    self._record_failure(url, resp.status_code)
                     return None
         else:  # Out of retries -> Failed
+            if self.retry_scheduler is not None:
+                return self._schedule_retry(url, failure)
             self._handle_request_exception(url, 'Out of retries! \n\n'
-                                                ' The program ignores it and jumps to the next one.')
+                                                ' The program ignores it and jumps to the next one.',
+                                           False)  # The tries are already counted
+            self._record_failure(url, failure)
             return None
 
+        chain = redirect_chain(resp)
+        if len(chain) > 0 and cached_resp_record is None:
+            known_url = self._known_redirect_target(url, chain)
+            if known_url is not None:  # Do not download the same page again under an other URL
+                resp.close()
+                self.aliases[url] = known_url
+                if partial is not None:
+                    self._partials.remove(url)
+                if self.retry_scheduler is not None:
+                    self.retry_scheduler.forget(url)
+                self._logger.log('INFO', url, f'Not downloading URL, because it redirects to {known_url}'
+                                              f' which is already downloaded', sep='\t')
+                return None
+            self._logger.log('DEBUG', url, 'Redirected to', resp.url, sep='\t')
+
         # REQUEST (build headers for warc)
         reqv_headers = resp.request.headers
         reqv_headers['Host'] = netloc
+        reqv_headers.pop('Range', None)  # The records hold the whole payload as if it was downloaded at once
+        reqv_headers.pop('If-Range', None)
 
         proto = f'HTTP/{respv_str[resp.raw.version]}'  # Friendly protocol name
         reqv_http_headers = StatusAndHeaders(f'GET {urlunparse(("", "", path, params, query, fragment))} {proto}',
                                              reqv_headers.items(), is_http_request=True)
-        reqv_record = self._writer.create_warc_record(url, 'request', http_headers=reqv_http_headers)
+        reqv_record = self._record_builder.create_warc_record(url, 'request', http_headers=reqv_http_headers)
 
         # RESPONSE
         # resp_status need to be stripped (e.g. empty reason)
@@ -386,28 +1134,123 @@ class WarcDownloader:
         # Must get peer_name before the content is read
         peer_name = self._get_peer_name(resp)
 
-        try:
-            data = resp.raw.read()  # To be able to return decoded and also write warc
-        except ProtocolError as err:
-            self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
-                                                f' The program ignores it and jumps to the next one.')
-            return None
+        if resp.status_code == 304:  # Not Modified: refer to the cached response with a revisit record
+            resp.close()
+            cached_headers = cached_resp_record.rec_headers
+            warc_headers_dict = {'WARC-IP-Address': peer_name,
+                                 'WARC-Refers-To': cached_headers.get_header('WARC-Record-ID')}
+            revisit_record = self._record_builder.create_revisit_record(
+                url, cached_headers.get_header('WARC-Payload-Digest'), url, cached_headers.get_header('WARC-Date'),
+                http_headers=StatusAndHeaders(resp_status, resp_headers_list, protocol=proto),
+                warc_headers_dict=self._proxy_header(resp, warc_headers_dict))
+            revisit_record.rec_headers.replace_header('WARC-Profile', SERVER_NOT_MODIFIED_PROFILE)
+            text = revalidate[1]
+            self._logger.log('INFO', url, 'Not modified since it was cached', sep='\t')
+            if self.failure_store is not None:
+                self.failure_store.record_success(url)
+            if return_warc_records_wo_writing:
+                return (None, reqv_record, revisit_record), text
+            self.write_records_for_url(url, (None, reqv_record, revisit_record), route_key)
+            return text
+
+        headers = resp.headers
+        chunks = []
+        if partial is not None and resp.status_code == 206:
+            # The record is built from the interrupted 200 response and the whole payload
+            if not self._is_valid_resumption(resp, partial, partial['size']):
+                resp.close()
+                self._partials.remove(url)
+                self._handle_request_exception(url, f'Resuming the download failed: invalid Content-Range'
+                                                    f' ({resp.headers.get("Content-Range")}) \n\n'
+                                                    f' The program ignores it and jumps to the next one.', False)
+                return None
+            resp_status, proto = partial['status'], partial['proto']
+            resp_headers_list = [tuple(header) for header in partial['headers']]
+            headers = CaseInsensitiveDict(resp_headers_list)
+            chunks.append(self._partials.read(url))
+            self._logger.log('INFO', url, f'Resuming the download from byte {partial["size"]}', sep='\t')
+        elif self._partials is not None:
+            if partial is not None:  # The server sent the whole payload (e.g. it has changed since): start over
+                self._partials.remove(url)
+                partial = None
+            validator = resume_validator(headers)  # The new payload can be resumed with its own validator
+            if validator is not None:  # Can be resumed if interrupted
+                partial = {'status': resp_status, 'headers': list(resp_headers_list), 'proto': proto,
+                           'validator': validator, 'length': int(headers['Content-Length'])}
+
+        # Resume the interrupted downloads immediately or in the next try when the retries are deferred
+        resumes_left = self._max_retries - 1 if self.retry_scheduler is None else 0
+        while True:
+            try:
+                self._check_headers(resp)  # Before reading the body
+                data = self._read_body(resp, url, chunks)  # To be able to return decoded and also write warc
+                break
+            except ResponseRejected as err:
+                if partial is not None:
+                    self._partials.remove(url)
+                return self._reject_response(url, resp, err)
+            except (ProtocolError, ReadTimeoutError) as err:
+                resp.close()
+                msg = f'RequestException happened during downloading: {err}'
+                if partial is not None and self._partials.save(url, partial, chunks) and resumes_left > 0:
+                    self._handle_request_exception(url, msg)
+                    resumes_left -= 1
+                    resp = self._resume_download(url, url_reparsed, partial, sum(len(chunk) for chunk in chunks))
+                    if resp is not None:
+                        continue
+                    msg = None  # The failure is already handled
+                if self.retry_scheduler is not None:
+                    self._handle_request_exception(url, msg)
+                    # The next try continues from the stored part if possible
+                    return self._schedule_retry(url, type(err).__name__)
+                if partial is not None:
+                    self._partials.remove(url)
+                self._record_failure(url, type(err).__name__)
+                if msg is None:
+                    self._logger.log('WARNING', url, 'Out of retries! \n\n'
+                                                     ' The program ignores it and jumps to the next one.', sep='\t')
+                else:
+                    self._handle_request_exception(url, f'{msg} \n\n'
+                                                        f' The program ignores it and jumps to the next one.')
+                return None
+
+        if partial is not None:
+            self._partials.remove(url)
+            if len(data) != partial['length']:
+                self._handle_request_exception(url, f'The length of the payload ({len(data)}) differs from'
+                                                    f' Content-Length ({partial["length"]}) \n\n'
+                                                    f' The program ignores it and jumps to the next one.', False)
+                return None
 
         if len(data) == 0:
             err = 'Response data has zero length!'
             self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
-                                                f' The program ignores it and jumps to the next one.')
+                                                f' The program ignores it and jumps to the next one.', False)
             return None
 
-        # warcio hack as \r\n is the record separator and trailing ones will be split and digest will eventually fail!
-        if data.endswith(b'\r\n'):  # TODO: Warcio bugreport!
-            data = data.rstrip()
+        content_encoding = headers.get('Content-Encoding')
+        if content_encoding is None or content_encoding.strip().lower() in {'', 'identity'}:
+            # warcio hack as \r\n is the record separator and trailing ones will be split and digest will eventually
+            # fail!
+            if data.endswith(b'\r\n'):  # TODO: Warcio bugreport!
+                data = data.rstrip()
+            content = data
+        else:  # The compressed bytes are stored as transferred and only the returned content is decoded
+            try:
+                content = decode_content_encoding(data, content_encoding, self._max_body_size)
+            except ResponseRejected as err:  # E.g. a compression bomb
+                return self._reject_response(url, resp, err)
+            except (ValueError, ZlibError) as err:
+                self._handle_request_exception(url, f'Decoding Content-Encoding ({content_encoding}) failed: {err}'
+                                                    f' \n\n The program ignores it and jumps to the next one.',
+                                               False)
+                return None
 
         if decode:
             # Get or detect encoding to decode the bytes of the text to str
-            enc = patched_get_encoding_from_headers(resp.headers)
+            enc = patched_get_encoding_from_headers(headers)
             if enc is None:
-                # TODO What now?
+                # chardet is only the last resort (on a sample) as it is slow and weak on Hungarian:
                 # https://github.com/chardet/chardet/commit/da6c0a079c41683ca475e28364fcf9c4d34f4359
                 # Temporarily disable Hungarian probers...
                 # committed on Jan 7, 2015
@@ -415,45 +1258,171 @@ class WarcDownloader:
                 # "disabled until we can retrain the models."
                 # More info: https://github.com/chardet/chardet/issues/87
                 # and https://github.com/chardet/chardet/pull/99
-                enc = detect(data)['encoding']
+                enc = self._charset_detector.detect(url, content)
             try:
-                text = data.decode(enc)  # Normal decode process
+                text = content.decode(enc)  # Normal decode process
             except UnicodeDecodeError:
+                self._charset_detector.forget(url)  # Do not trust the remembered encoding of the site anymore
                 self._logger.log('WARNING', 'DECODE ERROR RETRYING IN \'IGNORE\' MODE:', url, enc, sep='\t')
-                text = data.decode(enc, 'ignore')
-        else:
-            enc = 'None'
-            text = data
+                text = content.decode(enc, 'ignore')
+        else:  # The raw bytes with the known or cheaply sniffed encoding for the parsers which decode natively
+            enc = patched_get_encoding_from_headers(headers)
+            if enc is None:
+                enc = self._charset_detector.sniff(url, content)
+            text = HTMLBytes(content, enc)
+            enc = str(enc)  # 'None' if unknown
 
         data_stream = BytesIO(data)  # Need the original byte stream to write the payload to the warc file
         resp_http_headers = StatusAndHeaders(resp_status, resp_headers_list, protocol=proto)
         # Add extra headers like encoding because it is not stored any other way...
-        resp_record = self._writer.create_warc_record(url, 'response', payload=data_stream,
-                                                      http_headers=resp_http_headers,
-                                                      warc_headers_dict={'WARC-IP-Address': peer_name,
-                                                                         'WARC-X-Detected-Encoding': enc})
+        warc_headers_dict = {'WARC-IP-Address': peer_name, 'WARC-X-Detected-Encoding': enc}
+        if len(chain) > 0:  # The record is stored under the requested URL, the others are its aliases
+            warc_headers_dict['WARC-X-Redirect-Chain'] = ' '.join(chain)
+        resp_record = self._record_builder.create_warc_record(url, 'response', payload=data_stream,
+                                                              http_headers=resp_http_headers,
+                                                              warc_headers_dict=self._proxy_header(
+                                                                  resp, warc_headers_dict))
         # Everything is OK
+        if self.retry_scheduler is not None:
+            self.retry_scheduler.forget(url)
+        if self.failure_store is not None:
+            self.failure_store.record_success(url)
         if return_warc_records_wo_writing:
             # Return the WARC records and the text content. no writing (e.g. for external retry logic)
             return (None, reqv_record, resp_record), text
         else:
             # Write the two WARC records and return the text content only
-            self.write_records_for_url(url, (None, reqv_record, resp_record))
+            self.write_records_for_url(url, (None, reqv_record, resp_record), route_key)
 
             return text
 
-    def write_records_for_url(self, url, rec):
+    def write_records_for_url(self, url, rec, route_key=None):
         self.good_urls.add(url)
+        writer = self._router.get_writer_for_url(url, route_key)
         if rec[0] is not None:
             cache, (reqv_offset, _), (resp_offset, _) = rec
             reqv_record = cache.get_record(reqv_offset)  # Seek to the appropriate pos in the WARC to retrive the record
-            self._writer.write_record(reqv_record)       # else random zlib errors happen when the payload is retrieved
+            writer.write_record(reqv_record)             # else random zlib errors happen when the payload is retrieved
             resp_record = cache.get_record(resp_offset)  # from the cache
-            self._writer.write_record(resp_record)
+            writer.write_record(resp_record)
         else:
             _, reqv_record, resp_record = rec
-            self._writer.write_record(reqv_record)
-            self._writer.write_record(resp_record)
+            writer.write_record(reqv_record)
+            writer.write_record(resp_record)
+            chain = resp_record.rec_headers.get_header('WARC-X-Redirect-Chain')
+            if chain is not None:
+                add_redirect_aliases(self.aliases, url, chain.split(' '))
+
+
+class WarcWriterRouter:
+    """
+        Write the records into one or more output WARC files selected by the routing function for each URL:
+         route_fun(url, route_key) -> filename, where route_key is the optional value supplied to download_url()
+        The output files are opened lazily when the first record is routed to them
+    """
+    def __init__(self, route_fun, _logger, warcinfo_record_data, overwrite_warc=True, durability=None):
+        self._route_fun = route_fun
+        self._logger = _logger
+        self._warcinfo_record_data = warcinfo_record_data
+        self._overwrite_warc = overwrite_warc
+        if durability is None:
+            durability = DurabilityPolicy()
+        self._durability = durability  # Output files are flushed according to the durability policy
+        self._writers = {}
+
+    @staticmethod
+    def _set_target_filename(filename, overwrite_warc):
+        if not overwrite_warc:  # Find out next nonexisting warc filename
+            orig_filename = filename
+            num = 0
+            while Path(filename).exists():
+                filename = numbered_warc_filename(orig_filename, num)
+                num += 1
+
+        return filename
+
+    def get_writer(self, expected_filename):
+        writer = self._writers.get(expected_filename)
+        if writer is None:
+            filename = self._set_target_filename(expected_filename, self._overwrite_warc)
+            self._logger.log('INFO', 'Creating archivefile:', filename)
+            writer = WARCWriter(self._durability.open(filename, 'wb'), gzip=True, warc_version='WARC/1.1')
+            info_record = writer.create_warcinfo_record(str(filename), self._warcinfo_record_data)
+            writer.write_record(info_record)
+            self._writers[expected_filename] = writer
+        return writer
+
+    def get_writer_for_url(self, url, route_key=None):
+        return self.get_writer(self._route_fun(url, route_key))
+
+    @property
+    def filenames(self):  # Ready-only property for shortcut
+        return self._writers.keys()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.out.close()
+
+
+class WarcCopyWriter:
+    """
+        Create a new WARC file from request-response pairs copied from WarcReaders and write its index file
+         in the same pass. Records are copied byte-for-byte when the source is compressed per record (as written
+         by this program), records of uncompressed sources are compressed as is into separate gzip members.
+    """
+    def __init__(self, filename, _logger, warcinfo_record_data=None):
+        self.filename = filename
+        self._logger = _logger
+        self._index = {}
+        self._redirect_chains = {}
+        self._logger.log('INFO', 'Creating archivefile:', filename)
+        self._output_file = open(filename, 'wb')
+        if warcinfo_record_data is None:
+            warcinfo_record_data = default_warcinfo_record_data()
+        writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
+        writer.write_record(writer.create_warcinfo_record(str(filename), warcinfo_record_data))
+
+    def __del__(self):
+        if hasattr(self, '_output_file'):  # If the program opened a file, then it should gracefully close it on exit!
+            self._output_file.close()
+
+    @property
+    def size(self):  # Ready-only property for shortcut
+        return self._output_file.tell()
+
+    @property
+    def url_index(self):  # Ready-only property for shortcut
+        return self._index.keys()
+
+    def copy_records_for_url(self, url, reader):
+        reqv, resp = reader.get_record_data(url)
+        self._index[url] = (self._copy_record(reader, *reqv), self._copy_record(reader, *resp))
+        chain = reader.redirect_chain(url)
+        if chain is not None:
+            self._redirect_chains[url] = chain
+
+    def _copy_record(self, reader, offset, length):
+        new_offset = self._output_file.tell()
+        raw_it = reader.iter_raw_record(offset, length)
+        first_chunk = next(raw_it)
+        if first_chunk.startswith(b'\x1f\x8b'):  # Gzip member -> Copy as is
+            self._output_file.write(first_chunk)
+            for chunk in raw_it:
+                self._output_file.write(chunk)
+        else:  # Uncompressed record (the length excludes the record separator) -> Compress it into a gzip member
+            compressor = compressobj(9, DEFLATED, MAX_WBITS + 16)
+            self._output_file.write(compressor.compress(first_chunk))
+            for chunk in raw_it:
+                self._output_file.write(compressor.compress(chunk))
+            self._output_file.write(compressor.compress(b'\r\n\r\n'))
+            self._output_file.write(compressor.flush())
+        return new_offset, self._output_file.tell() - new_offset
+
+    def close(self):
+        """Close the WARC file and write its index file"""
+        if not self._output_file.closed:
+            self._output_file.close()
+            WarcReader.write_index_file(self.filename, self._index, self._redirect_chains)
 
 
 class WarcReader:
@@ -461,15 +1430,22 @@ class WarcReader:
         self.filename = filename
         self._stream = open(filename, 'rb')
         self._internal_url_index = {}
+        self._redirect_chains = {}  # URL -> the URLs of its redirect chain (see WARC-X-Redirect-Chain)
+        self.aliases = {}  # Alias URL -> the URL of the record it is redirected to
         self._logger = _logger
         self.info_record_data = None
         self._strict_mode = strict_mode
         if check_digest:
             check_digest = 'raise'
         self._check_digest = check_digest
+        self._charset_detector = CharsetDetector()
         self._allow_empty_warc = allow_empty_warc
         try:
-            self._create_index()
+            # Use the up-to-date index file (e.g. written by merge) if there is no need to validate the whole WARC
+            if not self._strict_mode and not self._check_digest and self._index_file_is_up_to_date():
+                self._load_index_file()
+            else:
+                self._create_index()
         except KeyError as e:
             if self._strict_mode:
                 raise e
@@ -483,9 +1459,56 @@ class WarcReader:
     def url_index(self):  # Ready-only property for shortcut
         return self._internal_url_index.keys()
 
-    def _create_index(self):
-        self._logger.log('INFO', f'Creating index for {self.filename}...')
-        archive_it = ArchiveIterator(self._stream, check_digests=self._check_digest)
+    @staticmethod
+    def index_filename(filename):
+        """The sidecar index file of the WARC file (one request-response pair per line, see write_index_file())"""
+        return f'{filename}.idx'
+
+    @staticmethod
+    def write_index_file(filename, url_index, redirect_chains=None):
+        """
+            Write URL TAB request offset TAB request length TAB response offset TAB response length lines
+             (and TAB the space separated redirect chain for the redirected URLs)
+        """
+        if redirect_chains is None:
+            redirect_chains = {}
+        with open(WarcReader.index_filename(filename), 'w', encoding='UTF-8') as fh:
+            for url, ((reqv_offset, reqv_length), (resp_offset, resp_length)) in url_index.items():
+                chain = redirect_chains.get(url)
+                if chain is None:
+                    print(url, reqv_offset, reqv_length, resp_offset, resp_length, sep='\t', file=fh)
+                else:
+                    print(url, reqv_offset, reqv_length, resp_offset, resp_length, ' '.join(chain), sep='\t',
+                          file=fh)
+
+    def redirect_chain(self, url):
+        """The URLs of the redirect chain of the record or None if it was not redirected"""
+        return self._redirect_chains.get(url)
+
+    def _add_redirect_chain(self, url, chain):
+        self._redirect_chains[url] = chain
+        add_redirect_aliases(self.aliases, url, chain)
+
+    def _index_file_is_up_to_date(self):
+        index_filename = Path(self.index_filename(self.filename))
+        return index_filename.exists() and index_filename.stat().st_mtime >= Path(self.filename).stat().st_mtime
+
+    def _load_index_file(self):
+        self._logger.log('INFO', f'Loading index for {self.filename} from {self.index_filename(self.filename)}...')
+        self._read_info_record(ArchiveIterator(self._stream))
+        with open(self.index_filename(self.filename), encoding='UTF-8') as fh:
+            for line in fh:
+                url, reqv_offset, reqv_length, resp_offset, resp_length, *chain = line.rstrip('\n').split('\t')
+                self._internal_url_index[url] = ((int(reqv_offset), int(reqv_length)),
+                                                 (int(resp_offset), int(resp_length)))
+                if len(chain) > 0:
+                    self._add_redirect_chain(url, chain[0].split(' '))
+        if len(self._internal_url_index) == 0 and not self._allow_empty_warc:
+            raise IndexError('No index created or no response records in the WARC file!')
+        self._stream.seek(0)
+        self._logger.log('INFO', 'Index successfully loaded.')
+
+    def _read_info_record(self, archive_it):
         info_rec = next(archive_it)
         # First record should be an info record, then it should be followed by the request-response pairs
         assert info_rec.rec_type == 'warcinfo'
@@ -507,8 +1530,14 @@ class WarcReader:
                              'is corrupt! Continuing with a fresh one!')
             self.info_record_data = None
 
+    def _create_index(self):
+        self._logger.log('INFO', f'Creating index for {self.filename}...')
+        archive_it = ArchiveIterator(self._stream, check_digests=self._check_digest)
+        self._read_info_record(archive_it)
+
         archive_load_failed = False
         count = 0
+        revisits = 0
         double_urls = Counter()
         reqv_data = (None, (None, None))  # To be able to handle the request-response pairs together
         i = 0
@@ -533,7 +1562,13 @@ class WarcReader:
                 except ArchiveLoadFailed as e:
                     self._logger.log('ERROR', 'RESPONSE:', e.msg, 'for', resp_url)
                     archive_load_failed = True
+                chain = record.rec_headers.get_header('WARC-X-Redirect-Chain')
+                if chain is not None:
+                    self._add_redirect_chain(resp_url, chain.split(' '))
                 count += 1
+            elif record.rec_type == 'revisit':  # Not indexed as the payload is in the WARC file referred to
+                assert i % 2 == 1
+                revisits += 1
         if count != len(self._internal_url_index):
             doubles = []
             for url, freq in double_urls.most_common():
@@ -542,8 +1577,10 @@ class WarcReader:
                 doubles.append(f'{url}\t{freq}')
             double_urls_str = '\n'.join(doubles)
             raise KeyError(f'The following double URLs detected in the WARC file:{double_urls_str}')
+        if revisits > 0:
+            self._logger.log('INFO', f'Skipped {revisits} revisit records (the previous WARC files contain them)')
         if count == 0:
-            if self._allow_empty_warc and i == 0:
+            if (self._allow_empty_warc and i == 0) or revisits > 0:
                 self._logger.log('INFO', 'No response records in the WARC file (this is fine)!')
             else:
                 raise IndexError('No index created or no response records in the WARC file!')
@@ -564,6 +1601,16 @@ class WarcReader:
         rec = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
         return rec
 
+    def iter_raw_record(self, offset, length, chunk_size=1024 * 1024):
+        """Yield the bytes of the record as stored in the WARC file (a whole gzip member if compressed)"""
+        self._stream.seek(offset)
+        while length > 0:
+            chunk = self._stream.read(min(chunk_size, length))
+            if len(chunk) == 0:
+                raise ArchiveLoadFailed(f'Unexpected end of file at offset {offset} in {self.filename}')
+            length -= len(chunk)
+            yield chunk
+
     def download_url(self, url, decode=True):
         text = None
         reqv_resp_pair = self._internal_url_index.get(url)
@@ -573,11 +1620,13 @@ class WarcReader:
             record = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
             data = record.content_stream().read()
             assert len(data) > 0
+            enc = record.rec_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')
             if decode:
-                enc = record.rec_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')
+                if enc == 'None':  # Downloaded as raw bytes with unknown encoding
+                    enc = self._charset_detector.detect_encoding(data) or 'UTF-8'
                 text = data.decode(enc, 'ignore')
             else:
-                text = data
+                text = HTMLBytes(data, enc if enc != 'None' else None)
         else:
             self._logger.log('CRITICAL', url, 'URL not found in WARC!', sep='\t')
 
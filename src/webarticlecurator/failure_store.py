@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+from math import inf
+from time import time
+from threading import Lock
+from datetime import datetime
+
+
+class FailureStore:
+    """
+        Persistent store of the failing URLs (the last status or error, the time of the last failure and the number
+         of failures in a row) to stop retrying them in every run:
+         - after a failure the URL is skipped for backoff seconds (doubled after each further failure)
+         - after permanent_after failures in a row the URL is permanently bad (until it is removed from the file)
+         - a successful download clears the URL
+        The file has URL TAB status TAB time of the last failure (ISO format) TAB no. of failures lines. The changes
+         are appended as they happen (the last line of the URL is valid, 0 failures: cleared) and the file is compacted
+         by close()
+    """
+    def __init__(self, filename, backoff=86400.0, permanent_after=3):
+        if backoff <= 0 or permanent_after < 1:
+            raise ValueError(f'backoff ({backoff}) must be positive and permanent_after ({permanent_after})'
+                             f' must be at least 1!')
+        self.filename = filename
+        self._backoff = backoff
+        self._permanent_after = permanent_after
+        self._failures = {}  # URL -> (status, timestamp of the last failure, no. of failures in a row)
+        self._lock = Lock()
+        if os.path.exists(filename):
+            self._load()
+        self._fh = open(filename, 'a', encoding='UTF-8')
+
+    def _load(self):
+        with open(self.filename, encoding='UTF-8') as fh:
+            for line in fh:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 4:  # E.g. the last line is truncated by a crash
+                    continue
+                url, status, failure_time, failures = fields
+                if int(failures) == 0:
+                    self._failures.pop(url, None)
+                else:
+                    self._failures[url] = (status, datetime.fromisoformat(failure_time).timestamp(), int(failures))
+
+    def _append(self, url, status, timestamp, failures):
+        print(url, status, datetime.fromtimestamp(timestamp).isoformat(timespec='seconds'), failures, sep='\t',
+              file=self._fh, flush=True)
+
+    def check(self, url):
+        """None if the URL can be downloaded, else the seconds until it can be retried (inf: permanently bad)"""
+        with self._lock:
+            failure = self._failures.get(url)
+        if failure is None:
+            return None
+        _, timestamp, failures = failure
+        if failures >= self._permanent_after:
+            return inf
+        wait = timestamp + self._backoff * 2 ** (failures - 1) - time()
+        if wait <= 0:
+            return None
+        return wait
+
+    def record_failure(self, url, status):
+        """Store the status code or the error of the failed download, returns True if the URL became permanently bad"""
+        timestamp = time()
+        with self._lock:
+            failures = self._failures.get(url, (None, None, 0))[2] + 1
+            self._failures[url] = (str(status), timestamp, failures)
+            self._append(url, status, timestamp, failures)
+        return failures == self._permanent_after
+
+    def record_success(self, url):
+        with self._lock:
+            if self._failures.pop(url, None) is not None:
+                self._append(url, 200, time(), 0)
+
+    def permanently_bad_urls(self):
+        with self._lock:
+            return {url for url, (_, _, failures) in self._failures.items() if failures >= self._permanent_after}
+
+    def stats(self):
+        """(no. of URLs in backoff, no. of permanently bad URLs)"""
+        with self._lock:
+            permanent = sum(1 for _, _, failures in self._failures.values() if failures >= self._permanent_after)
+            return len(self._failures) - permanent, permanent
+
+    def close(self):
+        """Compact the file: keep only the last state of the failing URLs"""
+        with self._lock:
+            if self._fh.closed:
+                return
+            self._fh.close()
+            tmp_filename = f'{self.filename}.tmp'
+            with open(tmp_filename, 'w', encoding='UTF-8') as self._fh:
+                for url, (status, timestamp, failures) in self._failures.items():
+                    self._append(url, status, timestamp, failures)
+            os.replace(tmp_filename, self.filename)
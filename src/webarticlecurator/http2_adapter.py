@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import sys
+from threading import Lock
+from http.client import HTTPMessage
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout, ProxyError, SSLError
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3 import HTTPHeaderDict
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+# HTTP version string of httpx -> the version number as urllib3 reports it (see respv_str)
+http_version_num = {'HTTP/1.0': 10, 'HTTP/1.1': 11, 'HTTP/2': 20}
+
+
+class Http2RawResponse:
+    """
+        The subset of urllib3.HTTPResponse (Response.raw) used by WarcDownloader and requests for an httpx response:
+         the version, the raw headers (with duplicates), the peer and the raw (still compressed) payload
+    """
+    def __init__(self, httpx_response):
+        self._response = httpx_response
+        self.version = http_version_num.get(httpx_response.http_version, 11)
+        self.headers = HTTPHeaderDict()
+        msg = HTTPMessage()  # For the cookie handling of requests
+        for key, value in httpx_response.headers.multi_items():
+            self.headers.add(key, value)
+            msg[key] = value
+        self._original_response = SimpleNamespace(msg=msg)
+        network_stream = httpx_response.extensions.get('network_stream')
+        server_addr = network_stream.get_extra_info('server_addr') if network_stream is not None else None
+        self.peer_name = server_addr[0] if server_addr is not None else None
+        self._chunks = httpx_response.iter_raw()
+        self._pending = b''
+
+    def _next_chunk(self):
+        httpx = sys.modules['httpx']
+        try:
+            return next(self._chunks, b'')
+        except httpx.TimeoutException as e:
+            raise ReadTimeoutError(None, str(self._response.url), str(e))
+        except httpx.TransportError as e:
+            raise ProtocolError(str(e), e)
+
+    def read(self, amt=None, decode_content=False):
+        _ = decode_content  # The payload is always returned as transferred
+        while amt is None or len(self._pending) < amt:
+            chunk = self._next_chunk()
+            if len(chunk) == 0:
+                break
+            self._pending += chunk
+        if amt is None:
+            amt = len(self._pending)
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    def read1(self, amt=None, decode_content=False):
+        """Return the pending or the next chunk as soon as it arrives"""
+        _ = decode_content  # The payload is always returned as transferred
+        if len(self._pending) == 0:
+            self._pending = self._next_chunk()
+        if amt is None:
+            amt = len(self._pending)
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+
+class Http2Adapter(BaseAdapter):
+    """
+        Transport adapter for requests which speaks HTTP/2 (through httpx, the optional httpx[http2] package)
+         with one connection per host multiplexing the concurrent requests (e.g. of download_url_async())
+        HTTP/1.1 is used when the server does not offer HTTP/2 (ALPN) or for plain http:// URLs
+        The responses are streamed as requests.Response objects with the still compressed payload in raw
+         like with the default HTTPAdapter
+    """
+    def __init__(self, pool_maxsize=10):
+        import httpx
+        self._httpx = httpx
+        super().__init__()
+        self._limits = httpx.Limits(max_keepalive_connections=pool_maxsize)
+        self._clients = {}  # (verify, proxy) -> httpx.Client
+        self._lock = Lock()
+
+    def _get_client(self, verify, proxy):
+        with self._lock:
+            client = self._clients.get((verify, proxy))
+            if client is None:
+                client = self._httpx.Client(http2=True, verify=verify, proxy=proxy, limits=self._limits,
+                                            follow_redirects=False)
+                self._clients[(verify, proxy)] = client
+        return client
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return self._httpx.Timeout(read, connect=connect)
+        return self._httpx.Timeout(timeout)  # None means no timeout as with requests
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        _ = stream, cert  # Always streamed, client certificates are not supported
+        proxy = (proxies or {}).get(urlparse(request.url).scheme)
+        client = self._get_client(verify, proxy)
+        httpx_request = client.build_request(request.method, request.url, headers=dict(request.headers),
+                                             content=request.body, timeout=self._timeout(timeout))
+        httpx = self._httpx
+        try:
+            httpx_response = client.send(httpx_request, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise ReadTimeout(e, request=request)
+        except httpx.ProxyError as e:
+            raise ProxyError(e, request=request)
+        except httpx.ConnectError as e:
+            if 'SSL' in str(e) or 'CERTIFICATE' in str(e):
+                raise SSLError(e, request=request)
+            raise ConnectionError(e, request=request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=request)
+
+        response = Response()
+        response.status_code = httpx_response.status_code
+        response.reason = httpx_response.reason_phrase
+        response.raw = Http2RawResponse(httpx_response)
+        response.headers = CaseInsensitiveDict(response.raw.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
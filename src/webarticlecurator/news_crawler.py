@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+from itertools import chain
+
 from mplogger import Logger
 
-from .utils import write_set_contents_to_file
+from .utils import write_set_contents_to_file, is_accepting_bytes
 from .enhanced_downloader import WarcCachingDownloader
+from .url_normalizer import UrlNormalizer
 from .strategies import date_range, gen_article_urls_and_subpages
 
 
+def url_normalizer_from_settings(settings):
+    """The UrlNormalizer configured by url_normalization (created once to share its memo between the crawlers)"""
+    if 'URL_NORMALIZER' not in settings:
+        settings['URL_NORMALIZER'] = UrlNormalizer(**settings.get('url_normalization', {}))
+    return settings['URL_NORMALIZER']
+
+
 class NewsArchiveCrawler:
     """
         Using the provided regexes
@@ -28,6 +38,7 @@ class NewsArchiveCrawler:
         self._ignore_archive_cache = None
         self._infinite_scrolling = None
         self._extract_article_urls_from_page_fun = None
+        self._decode_archive_pages = None
         self._find_next_page_url = None
         self._max_tries = None
 
@@ -41,13 +52,18 @@ class NewsArchiveCrawler:
             debug_params = {}
         self._logger = Logger(settings['log_file_archive'], **debug_params)
 
-        # Open files for writing gathered URLs if needed
+        # Open files for writing gathered URLs if needed (flushed according to the same policy as the WARC file)
+        self._durability = (downloader_params or {}).get('durability')
         self.good_urls = set()
         self._good_urls_filename = settings.get('new_good_archive_urls')
 
         self.problematic_urls = set()
         self._problematic_urls_filename = settings.get('new_problematic_archive_urls')
 
+        # The article URLs are compared in their canonical form (shared with the NewsArticleCrawler)
+        self._url_normalizer = url_normalizer_from_settings(settings)
+        self._taboo_article_urls = {self._url_normalizer.normalize(url) for url in settings['TABOO_ARTICLE_URLS']}
+
         # Setup the list of cached article URLs to stop archive crawling in time
         self.known_article_urls = set()
         if known_article_urls is not None:
@@ -56,10 +72,11 @@ class NewsArchiveCrawler:
                     self.known_article_urls = {line.strip() for line in fh}
             elif isinstance(known_article_urls, set):
                 self.known_article_urls = known_article_urls
+        self.known_article_urls = {self._url_normalizer.canonicalize(url) for url in self.known_article_urls}
 
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(existing_archive_filenames, new_archive_filename, self._logger,
-                                                 archive_just_cache, downloader_params)
+                                                 archive_just_cache, downloader_params, self._url_normalizer)
         # Known bad URLs (read-only, available at __init__ time)
         self.bad_urls = self._downloader.bad_urls
         # Known good URLs (read-only, available at __init__ time from cache)
@@ -81,6 +98,10 @@ class NewsArchiveCrawler:
         self._ignore_archive_cache = self._settings['ignore_archive_cache']
         self._infinite_scrolling = self._settings['infinite_scrolling']
         self._extract_article_urls_from_page_fun = self._settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN']
+        # The archive pages are not decoded if every extractor can process the raw bytes (see accepts_bytes)
+        extract_next_page_url_fun = self._settings['EXTRACT_NEXT_PAGE_URL_FUN']
+        self._decode_archive_pages = not is_accepting_bytes(self._extract_article_urls_from_page_fun) or \
+            (extract_next_page_url_fun is not None and not is_accepting_bytes(extract_next_page_url_fun))
 
         # Store the constant parameters for the actual function used later
         self._find_next_page_url = \
@@ -89,7 +110,7 @@ class NewsArchiveCrawler:
                                              self._settings['infinite_scrolling'], column_spec_settings['max_pagenum'],
                                              self._settings['new_article_url_threshold'], self.known_article_urls,
                                              self._settings['stop_on_empty_archive_page'],
-                                             self._settings['stop_on_taboo_set'], self._settings['TABOO_ARTICLE_URLS'],
+                                             self._settings['stop_on_taboo_set'], self._taboo_article_urls,
                                              column_spec_settings.get('last_archive_page_url'))
 
 
@@ -100,9 +121,12 @@ class NewsArchiveCrawler:
             The archive can be stored in groups (mostly the creation date) or ordered in a flat list paginated.
             This two main method can also be mixed.
             Pagination can be implemented in various ways, see the appropriate function for details
+            Archive pages, which are scheduled for retrying (see RetryPolicy) are resumed when their retry is due,
+             the other archive pages are processed meanwhile
         :return: Every page of the archive contain multiple URL to the actual articles, which are extracted and
          then returned as an iterator based on URLs.
         """
+        deferred_pages = {}  # Archive page URL -> (column name, column params, (base URL, page number, first page))
         for column_name, params in self._columns.items():
             self._logger.log('INFO', 'Starting column:', column_name)
             # 1) Set params for the actual column
@@ -117,18 +141,48 @@ class NewsArchiveCrawler:
 
             # 4) Iterate the archive URLs and process them, while generating the required page URLs on demand
             for base_url in archive_page_urls:
-                yield from gen_article_urls_and_subpages(base_url, self._downloader,
-                                                         self._extract_articles_and_gen_next_page_link_fun,
-                                                         self.bad_urls, self.good_urls, self._good_urls_filename,
-                                                         self.problematic_urls, self._problematic_urls_filename,
-                                                         self._initial_page_num, self._min_pagenum,
-                                                         self._infinite_scrolling, self._max_tries,
-                                                         self._ignore_archive_cache, self._logger)
+                yield from self._gen_article_urls(column_name, params, base_url, deferred_pages)
+                # 5) Resume the pages whose retry is due meanwhile (they may belong to other columns)
+                yield from self._resume_deferred_pages(deferred_pages, self._downloader.due_retries())
+                self._store_settings(params)
+
+        # 6) Resume the remaining deferred pages by waiting for their retries
+        yield from self._resume_deferred_pages(deferred_pages, self._downloader.wait_for_retries())
+
+    def close(self):
+        """Close the downloader: write out the WARC file, stop the worker threads and log the session statistics"""
+        self._downloader.close()
+
+    def _gen_article_urls(self, column_name, params, base_url, deferred_pages, resume_from=None):
+        column_deferred_pages = {}
+        yield from gen_article_urls_and_subpages(base_url, self._downloader,
+                                                 self._extract_articles_and_gen_next_page_link_fun,
+                                                 self.bad_urls, self.good_urls, self._good_urls_filename,
+                                                 self.problematic_urls, self._problematic_urls_filename,
+                                                 self._initial_page_num, self._min_pagenum,
+                                                 self._infinite_scrolling, self._max_tries,
+                                                 self._ignore_archive_cache, self._logger,
+                                                 self._durability, column_deferred_pages, resume_from,
+                                                 self._decode_archive_pages)
+        for page_url, state in column_deferred_pages.items():
+            deferred_pages[page_url] = (column_name, params, state)
+
+    def _resume_deferred_pages(self, deferred_pages, due_urls):
+        """Continue crawling the archive from the pages whose download failed, but it is due for retrying now"""
+        for page_url in due_urls:
+            if page_url not in deferred_pages:
+                continue
+            column_name, params, (base_url, page_num, first_page) = deferred_pages.pop(page_url)
+            self._logger.log('INFO', 'Resuming archive page of column:', column_name, page_url, sep='\t')
+            self._store_settings(params)
+            yield from self._gen_article_urls(column_name, params, base_url, deferred_pages,
+                                              (page_url, page_num, first_page))
 
     def _extract_articles_and_gen_next_page_link_fun(self, archive_page_url_base, curr_page_url, archive_page_raw_html,
                                                      infinite_scrolling, first_page, page_num, logger):
         """Use preset site-specific functions to extract articles and next page link"""
         article_urls = self._extract_article_urls_from_page_fun(archive_page_raw_html)
+        article_urls = {self._url_normalizer.normalize(url) for url in article_urls}
         if len(article_urls) == 0 and (not infinite_scrolling or first_page):
             logger.log('WARNING', curr_page_url, 'Could not extract URLs from the archive!', sep='\t')
         # 2) Generate next-page URL or None if there should not be any
@@ -185,6 +239,10 @@ class NewsArchiveDummyCrawler:
     def url_iterator(self):
         return self._url_index_keys
 
+    @staticmethod
+    def close(*_, **__):
+        return None
+
 
 class NewsArticleCrawler:
     """
@@ -203,7 +261,8 @@ class NewsArticleCrawler:
         # Initialise the logger
         self._logger = Logger(settings['log_file_articles'])
 
-        # Open files for writing gathered URLs if needed
+        # Open files for writing gathered URLs if needed (flushed according to the same policy as the WARC file)
+        self._durability = (download_params or {}).get('durability')
         self._new_urls = set()
         self._new_urls_filename = settings.get('new_good_urls')
 
@@ -219,10 +278,13 @@ class NewsArticleCrawler:
         # Get the initialised corpus converter (can be dummy) and set the appropriate logger
         self._converter = settings['CORPUS_CONVERTER']
         self._converter.logger = self._logger
+        # The articles are not decoded if the converter can process the raw bytes (see accepts_bytes)
+        self._decode_articles = not is_accepting_bytes(self._converter)
 
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(articles_existing_warc_filenames, articles_new_warc_filename,
-                                                 self._logger, articles_just_cache, download_params)
+                                                 self._logger, articles_just_cache, download_params,
+                                                 url_normalizer_from_settings(settings))
 
         if known_article_urls is None:  # If None is supplied copy the ones from the article archive
             known_article_urls = self._downloader.url_index  # All URLs in the archive are known good!
@@ -240,6 +302,11 @@ class NewsArticleCrawler:
         if hasattr(self, '_archive_downloader'):  # Make sure that the previous files are closed...
             del self._archive_downloader
 
+    def close(self):
+        """Close the downloaders of the articles and the archive (see NewsArchiveCrawler.close())"""
+        self._downloader.close()
+        self._archive_downloader.close()
+
     def _is_problematic_url(self, url):
         # Explicitly marked as bad URL (either Article or Archive) OR
         # Download failed in this session and requires manual check (either Article or Archive)
@@ -257,12 +324,15 @@ class NewsArticleCrawler:
 
     def process_urls(self, it):
         urls = set()
-        with write_set_contents_to_file(self.problematic_article_urls,
-                                        self._problematic_article_urls_filename) as problematic_article_urls_add, \
-                write_set_contents_to_file(self._new_urls, self._new_urls_filename) as new_urls_add:
-
-            for url in it:
-                urls.add(url)
+        with write_set_contents_to_file(self.problematic_article_urls, self._problematic_article_urls_filename,
+                                        self._durability) as problematic_article_urls_add, \
+                write_set_contents_to_file(self._new_urls, self._new_urls_filename,
+                                           self._durability) as new_urls_add:
+
+            # Failed downloads scheduled for retrying are processed when they are due and after the URLs ran out
+            for url in chain(it, self._downloader.wait_for_retries()):
+                urls.add(self._downloader.normalize_url(url))  # Deduplicate the canonical URLs
+                urls.update(self._downloader.due_retries())
                 while len(urls) > 0:
                     # This loop runs only one iteration if no URLs are extracted in step (6) else it consumes them first
                     url = urls.pop()
@@ -274,16 +344,32 @@ class NewsArticleCrawler:
                     # 1b) Download succeeded in this session either Article or Archive (duplicate)
                     # 1c) Download failed in this session
                     # and requires manual check either Article or Archive (duplicate)
-                    elif self._is_processed_good_url(url) or \
-                            url in self.problematic_article_urls or url in self._archive_downloader.problematic_urls:
+                    elif self._is_processed_good_url(self._downloader.aliases.get(url, url)) or \
+                            url in self.problematic_article_urls or url in self._archive_downloader.problematic_urls \
+                            or url in self._downloader.rejected_urls:
                         self._logger.log('WARNING', url, 'Not processing URL, because it is an URL already'
                                                          ' encountered in this session (including the caches)'
                                                          ' or it is known to point to the portal\'s archive!', sep='\t')
                         continue
+                    # 1d) Download failed in a previous run and it is not due for retrying yet (see FailureStore)
+                    elif self._downloader.is_backing_off(url):
+                        self._logger.log('INFO', url, 'Skipping URL, because it failed recently!', sep='\t')
+                        continue
 
                     # 2) "Download" article
-                    article_raw_html = self._downloader.download_url(url)
-                    if article_raw_html is None:  # Download failed, must be investigated!
+                    article_raw_html = self._downloader.download_url(url, decode=self._decode_articles)
+                    if article_raw_html is None and self._downloader.is_retry_scheduled(url):
+                        self._logger.log('INFO', url, 'Article download is deferred until its retry is due!', sep='\t')
+                        continue
+                    elif article_raw_html is None and url in self._downloader.aliases:  # Redirected to a duplicate
+                        self._logger.log('INFO', url, 'Article was not processed because it redirects to an already'
+                                                      ' processed article!', sep='\t')
+                        continue
+                    elif article_raw_html is None and url in self._downloader.rejected_urls:  # Size or content type
+                        self._logger.log('INFO', url, 'Article was not processed because its response was rejected!',
+                                         sep='\t')
+                        continue
+                    elif article_raw_html is None:  # Download failed, must be investigated!
                         self._logger.log('ERROR', url, 'Article was not processed because download failed!', sep='\t')
                         problematic_article_urls_add(url)  # New problematic URL for manual checking
                         continue
@@ -315,5 +401,6 @@ class NewsArticleCrawler:
                     # 6) Extract links to other articles and check for already extracted urls (also in the archive)?
                     urls_to_follow = self._converter.follow_links_on_page(url, article_raw_html, scheme)
                     # Only add those which has not been already handled to avoid loops!
+                    urls_to_follow = {self._downloader.normalize_url(url) for url in urls_to_follow}
                     urls |= {url for url in urls_to_follow
                              if not self._is_processed_good_url(url) and not self._is_problematic_url(url)}
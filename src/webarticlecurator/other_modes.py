@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+from zlib import crc32
 from itertools import groupby
 from collections import defaultdict
 
-from .enhanced_downloader import WarcCachingDownloader
+from .enhanced_downloader import WarcCachingDownloader, WarcReader, WarcCopyWriter, numbered_warc_filename, \
+    labelled_warc_filename
 from .utils import create_or_check_clean_dir, write_content_to_url_named_file
 
 
@@ -24,7 +26,7 @@ def online_test(url='https://index.hu/belfold/2018/08/27/fidesz_media_helyreigaz
 
 def sample_warc_by_urls(source_warcfiles, new_urls, sampler_logger, target_warcfile=None, out_dir=None, offline=True,
                         just_cache=False, negative=False, extract_article_urls_from_page_plus_fun=None, max_tries=3,
-                        allow_cookies=False, max_no_of_calls_in_period=2, limit_period=1):
+                        allow_cookies=False, max_no_of_calls_in_period=2, limit_period=1, rate_limit_burst=None):
     """ Create new warc file for the supplied list of URLs from an existing warc file """
     is_out_dir_mode = out_dir is not None
     if is_out_dir_mode:
@@ -43,7 +45,8 @@ def sample_warc_by_urls(source_warcfiles, new_urls, sampler_logger, target_warcf
     w = WarcCachingDownloader(source_warcfiles, target_warcfile, sampler_logger, just_cache=just_cache,
                               download_params={'stay_offline': offline, 'allow_cookies': allow_cookies,
                                                'max_no_of_calls_in_period': max_no_of_calls_in_period,
-                                               'limit_period': limit_period})
+                                               'limit_period': limit_period,
+                                               'rate_limit_burst': rate_limit_burst})
 
     new_urls = {url.strip() for url in new_urls}
     if negative:
@@ -128,3 +131,110 @@ def archive_page_contains_article_url(extract_article_urls_from_page_plus_fun, s
         sampler_logger.log('INFO', checked_url, 'has found in the following files (with unique metas):')
         for metas, url, fn in duplicates_w_uniq_metas:
             sampler_logger.log('INFO', '', url, *metas, fn, sep='\t')
+
+
+def _open_readers_last_wins(source_warcfiles, logger):
+    """
+        Index the source WARC files and yield (reader, url) pairs for the last occurrence of each URL
+         (the later source WARC file has priority as with the cache) in the order of the records in the source files
+    """
+    readers = [WarcReader(source_warcfile, logger) for source_warcfile in source_warcfiles]
+    last_reader_for_url = {}
+    for reader in readers:
+        for url in reader.url_index:
+            last_reader_for_url[url] = reader
+    no_of_pairs = sum(len(reader.url_index) for reader in readers)
+    logger.log('INFO', 'Read', no_of_pairs, 'records with', len(last_reader_for_url), 'unique URLs',
+               f'({no_of_pairs - len(last_reader_for_url)} duplicates dropped)')
+
+    # The last, top priority info record is used
+    info_record_data = next((reader.info_record_data for reader in reversed(readers)
+                             if reader.info_record_data is not None), None)
+
+    def reader_url_pairs():
+        for reader in readers:
+            # Read the kept records sequentially in the order of the source file
+            urls = sorted((url for url in reader.url_index if last_reader_for_url[url] is reader),
+                          key=lambda u: reader.get_record_data(u)[0][0])
+            for url in urls:
+                yield reader, url
+
+    return info_record_data, reader_url_pairs()
+
+
+def merge_warc_files(source_warcfiles, target_warcfile, merge_logger, max_size=None):
+    """
+        Merge the source WARC files into one compacted WARC file (or a set of WARC files rolled at max_size bytes)
+         keeping only the last occurrence of each URL (the later source WARC file has priority as with the cache)
+    """
+    info_record_data, reader_url_pairs = _open_readers_last_wins(source_warcfiles, merge_logger)
+    writers = []
+    for reader, url in reader_url_pairs:
+        if len(writers) == 0 or (max_size is not None and writers[-1].size >= max_size):
+            if len(writers) > 0:
+                writers[-1].close()
+            if max_size is None:
+                filename = target_warcfile
+            else:
+                filename = numbered_warc_filename(target_warcfile, len(writers))
+            writers.append(WarcCopyWriter(filename, merge_logger, info_record_data))
+        writers[-1].copy_records_for_url(url, reader)
+    if len(writers) > 0:
+        writers[-1].close()
+
+    return [writer.filename for writer in writers]
+
+
+def partition_warc_file(source_warcfiles, target_warcfile, partition_logger, by='hash', no_of_shards=2,
+                        columns=None):
+    """
+        Split the source WARC files into shards (keeping only the last occurrence of each URL as merge does) for
+         parallel processing:
+         - hash: into no_of_shards shards by the (stable) hash of the URL
+         - month: by the year and month of the WARC-Date of the response record
+         - column: by the longest matching archive_url_format prefix (until the first #tag) of the columns
+            in the portal's site schema (non-matching URLs go to the 'other' shard)
+        Records are copied byte-for-byte. A manifest (TARGET.manifest.tsv) is written with the shard key, filename,
+         number of URLs and size of each shard
+    """
+    if by == 'hash':
+        if no_of_shards < 1:
+            raise ValueError(f'The number of shards must be positive not {no_of_shards} !')
+
+        def shard_key_fun(url, _):
+            return f'{crc32(url.encode("UTF-8")) % no_of_shards:05d}'
+    elif by == 'month':
+        def shard_key_fun(url, reader):
+            resp_offset = reader.get_record_data(url)[1][0]
+            return reader.get_record(resp_offset).rec_headers.get_header('WARC-Date')[:7]  # YYYY-MM
+    elif by == 'column':
+        if columns is None or len(columns) == 0:
+            raise ValueError('Columns must be specified for partitioning by column!')
+        # Longest first to find the most specific prefix
+        column_prefixes = sorted(((params['archive_url_format'].split('#', maxsplit=1)[0], column_name)
+                                  for column_name, params in columns.items()), key=lambda x: len(x[0]), reverse=True)
+
+        def shard_key_fun(url, _):
+            column_name = next((name for prefix, name in column_prefixes if url.startswith(prefix)), 'other')
+            return ''.join(char if char.isalnum() else '_' for char in column_name)  # Safe for filenames
+    else:
+        raise ValueError(f'Unknown partitioning method: {by} !')
+
+    info_record_data, reader_url_pairs = _open_readers_last_wins(source_warcfiles, partition_logger)
+    writers = {}
+    for reader, url in reader_url_pairs:
+        shard_key = shard_key_fun(url, reader)
+        writer = writers.get(shard_key)
+        if writer is None:
+            writer = WarcCopyWriter(labelled_warc_filename(target_warcfile, shard_key), partition_logger,
+                                    info_record_data)
+            writers[shard_key] = writer
+        writer.copy_records_for_url(url, reader)
+
+    with open(f'{target_warcfile}.manifest.tsv', 'w', encoding='UTF-8') as manifest:
+        print('SHARD', 'FILENAME', 'URLS', 'BYTES', sep='\t', file=manifest)
+        for shard_key, writer in sorted(writers.items()):
+            print(shard_key, writer.filename, len(writer.url_index), writer.size, sep='\t', file=manifest)
+            writer.close()
+
+    return {shard_key: writer.filename for shard_key, writer in writers.items()}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import re
+import json
+from hashlib import sha1
+from tempfile import gettempdir
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)', re.IGNORECASE)
+
+
+def resume_validator(headers):
+    """
+        The validator (strong ETag or Last-Modified) of a response which can be resumed with Range requests
+         or None if the server does not advertise byte ranges or the payload can not be verified
+    """
+    if 'bytes' not in headers.get('Accept-Ranges', '').lower() or not headers.get('Content-Length', '').isdigit():
+        return None
+    etag = headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):  # Weak ETags can not be used with If-Range
+        return etag
+    return headers.get('Last-Modified')
+
+
+def parse_content_range(value):
+    """Content-Range header of a 206 Partial Content response -> (first byte, last byte, total length) or None"""
+    if value is None:
+        return None
+    m = CONTENT_RANGE_RE.fullmatch(value.strip())
+    if m is None:
+        return None
+    return tuple(int(num) for num in m.groups())
+
+
+class PartialDownloads:
+    """
+        The payloads which are interrupted midway are kept in spool_dir to be resumed with Range requests
+         (also by the deferred retries): one file for the received bytes and one for the response they belong to
+         (status line, headers, validator and the full length to verify the resumed payload)
+    """
+    def __init__(self, spool_dir=None):
+        if spool_dir is None:
+            spool_dir = os.path.join(gettempdir(), 'webarticlecurator-partial')
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+
+    def _paths(self, url):
+        key = sha1(url.encode('UTF-8')).hexdigest()
+        return os.path.join(self.spool_dir, f'{key}.part'), os.path.join(self.spool_dir, f'{key}.json')
+
+    def save(self, url, meta, chunks):
+        """Store the received bytes (only if there is any) with the metadata of the response"""
+        data_path, meta_path = self._paths(url)
+        size = sum(len(chunk) for chunk in chunks)
+        if size == 0:
+            return False
+        with open(data_path, 'wb') as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+        with open(meta_path, 'w', encoding='UTF-8') as fh:
+            json.dump(dict(meta, url=url, size=size), fh)
+        return True
+
+    def load(self, url):
+        """The metadata (with the size of the stored bytes) or None if there is no (usable) partial download"""
+        data_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='UTF-8') as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or not os.path.isfile(data_path) or os.path.getsize(data_path) != meta['size']:
+            self.remove(url)  # Corrupted or belongs to another URL
+            return None
+        return meta
+
+    def read(self, url):
+        with open(self._paths(url)[0], 'rb') as fh:
+            return fh.read()
+
+    def remove(self, url):
+        for path in self._paths(url):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
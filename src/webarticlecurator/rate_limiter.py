@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+from threading import Lock
+from tempfile import gettempdir
+from time import monotonic, sleep, time
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # On Windows
+    fcntl = None
+    import msvcrt
+
+
+class TokenBucket:
+    """
+        Token bucket with float rate (tokens per second) and burst capacity.
+        Callers reserve their token in arrival order (the bucket can go negative), so waiting callers are served
+         first-come-first-served (fair queuing) and nobody can overtake a caller who is already waiting
+    """
+    def __init__(self, rate, capacity):
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f'Rate ({rate}) must be positive and capacity ({capacity}) must be at least 1!')
+        self.rate = rate
+        self.requested_rate = rate  # The configured rate, the actual rate can be changed with set_rate()
+        self.capacity = capacity
+        self._tokens = capacity  # Allow a full burst at start
+        self._last_update = monotonic()
+        self._lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_update) * self.rate)
+        self._last_update = now
+
+    def reserve(self, tokens=1):
+        """Reserve the tokens and return the seconds to wait before using them"""
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()  # Tokens until now are accumulated with the old rate
+            self.rate = rate
+
+
+class HostRateLimiter:
+    """
+        Per-host token buckets shared by every downloader which uses the same instance (see shared_rate_limiter).
+        When downloaders request different limits for the same host, the stricter one (the lower rate
+         and the lower burst capacity) is applied
+        The time spent waiting is accumulated per host (see stats())
+    """
+    def __init__(self):
+        self._buckets = {}
+        self._stats = {}  # Host -> [no. of requests, no. of waits, seconds waited]
+        self._lock = Lock()
+
+    def _get_bucket(self, host, rate, capacity):
+        if rate <= 0 or capacity < 1:  # Also for the existing buckets
+            raise ValueError(f'Rate ({rate}) must be positive and capacity ({capacity}) must be at least 1!')
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(rate, capacity)
+                self._buckets[host] = bucket
+                self._stats[host] = [0, 0, 0.0]
+            elif rate < bucket.requested_rate or capacity < bucket.capacity:
+                bucket.requested_rate = min(rate, bucket.requested_rate)
+                bucket.set_rate(min(rate, bucket.rate))
+                bucket.capacity = min(capacity, bucket.capacity)
+            return bucket
+
+    def acquire(self, host, rate, capacity):
+        """Block until the next request to the host is allowed and return the seconds waited"""
+        bucket = self._get_bucket(host, rate, capacity)
+        wait = self._reserve(host, bucket)
+        if wait > 0:
+            sleep(wait)
+        with self._lock:
+            host_stats = self._stats[host]
+            host_stats[0] += 1
+            host_stats[1] += int(wait > 0)
+            host_stats[2] += wait
+        return wait
+
+    @staticmethod
+    def _reserve(_, bucket):
+        return bucket.reserve()
+
+    def get_rate(self, host):
+        """The actual rate for the host or None if the host is not seen yet"""
+        with self._lock:
+            bucket = self._buckets.get(host)
+        if bucket is not None:
+            return bucket.rate
+        return None
+
+    def set_rate(self, host, rate):
+        """Change the actual rate for a host which is already seen (see AIMDRateController)"""
+        with self._lock:
+            bucket = self._buckets[host]
+        bucket.set_rate(rate)
+
+    def stats(self):
+        """Host -> (no. of requests, no. of requests which had to wait, seconds waited)"""
+        with self._lock:
+            return {host: tuple(host_stats) for host, host_stats in self._stats.items()}
+
+
+# Every downloader in the process uses this one by default
+shared_rate_limiter = HostRateLimiter()
+
+
+class ByteRateLimiter:
+    """
+        Bandwidth shaping: the bytes read from the responses are paced to global_rate bytes per second in total
+         and to host_rate bytes per second per host (None: no limit) with bursts of burst_seconds worth of bytes
+        The bytes are accounted after they are read and the reader sleeps until the budget allows them, meanwhile
+         TCP flow control slows down the sender. Share one instance between the downloaders to share the budget
+    """
+    def __init__(self, global_rate=None, host_rate=None, burst_seconds=1.0):
+        if (global_rate is not None and global_rate <= 0) or (host_rate is not None and host_rate <= 0) or \
+                burst_seconds <= 0:
+            raise ValueError(f'Byte rates ({global_rate}, {host_rate}) must be positive or None and burst_seconds'
+                             f' ({burst_seconds}) must be positive!')
+        self._host_rate = host_rate
+        self._burst_seconds = burst_seconds
+        self._global_bucket = None
+        if global_rate is not None:
+            self._global_bucket = TokenBucket(global_rate, max(1, global_rate * burst_seconds))
+        self._host_buckets = {}
+        self._stats = {}  # Host -> [bytes, seconds waited]
+        self._lock = Lock()
+
+    def consume(self, host, num_bytes):
+        """Account the bytes read from the host, block until the budget allows them and return the seconds waited"""
+        wait = 0.0
+        if self._global_bucket is not None:
+            wait = self._global_bucket.reserve(num_bytes)
+        with self._lock:
+            host_stats = self._stats.setdefault(host, [0, 0.0])
+            bucket = None
+            if self._host_rate is not None:
+                bucket = self._host_buckets.get(host)
+                if bucket is None:
+                    bucket = TokenBucket(self._host_rate, max(1, self._host_rate * self._burst_seconds))
+                    self._host_buckets[host] = bucket
+        if bucket is not None:
+            wait = max(wait, bucket.reserve(num_bytes))
+        if wait > 0:
+            sleep(wait)
+        with self._lock:
+            host_stats[0] += num_bytes
+            host_stats[1] += wait
+        return wait
+
+    def stats(self):
+        """Host -> (no. of bytes read, seconds waited)"""
+        with self._lock:
+            return {host: tuple(host_stats) for host, host_stats in self._stats.items()}
+
+
+def _lock_file(fh):
+    fh.seek(0)
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+    else:
+        msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(fh):
+    fh.seek(0)
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SharedFileRateLimiter(HostRateLimiter):
+    """
+        HostRateLimiter whose per-host budget is shared by every process on the machine which uses the same state_dir
+         (e.g. parallel crawls of the portals of the same publisher)
+        The state of each host is one timestamp in a file locked while it is updated: the time when the next request
+         is allowed without bursting (GCRA, the token bucket algorithm in virtual scheduling form).
+         Every request reserves 1/rate seconds of the shared timeline with the rate of its own process,
+         so processes sharing a host get the budget of one process together in arrival order
+        The rates and the statistics are kept per process (see HostRateLimiter) and the wall clock is used
+         as it is the common clock of the processes
+    """
+    max_clock_skew = 3600  # Drop state from the future (e.g. the clock was set back)
+
+    def __init__(self, state_dir=None):
+        super().__init__()
+        if state_dir is None:
+            state_dir = os.path.join(gettempdir(), 'webarticlecurator-rate-limits')
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+
+    def _reserve(self, host, bucket):
+        interval = 1 / bucket.rate
+        with open(os.path.join(self.state_dir, quote(host, safe='')), 'a+b') as fh:
+            _lock_file(fh)
+            try:
+                now = time()
+                try:
+                    next_time = float(fh.read())
+                except ValueError:  # New or corrupted state file
+                    next_time = now
+                if next_time > now + self.max_clock_skew:
+                    next_time = now
+                next_time = max(next_time, now)
+                # The burst allows to start up to capacity-1 intervals earlier
+                wait = max(0.0, next_time - (bucket.capacity - 1) * interval - now)
+                fh.seek(0)
+                fh.truncate()
+                fh.write(repr(next_time + interval).encode('ascii'))
+                fh.flush()
+            finally:
+                _unlock_file(fh)
+        return wait
+
+
+class AIMDRateController:
+    """
+        Additive increase, multiplicative decrease of the per-host request rate of a HostRateLimiter
+         - After increase_every consecutive healthy responses (not HTTP 429 or 5xx and faster than
+            latency_threshold seconds) the rate is increased by rate_increase requests per second
+         - On timeouts, network errors, HTTP 429 or 5xx responses and responses slower than latency_threshold seconds
+            the rate is multiplied by decrease_factor (at most once in decrease_cooldown seconds as the requests
+            in flight usually fail together)
+        The rate is kept between min_rate and max_rate. Every decision is logged to be able to reuse the learned rate
+    """
+    def __init__(self, rate_limiter=None, min_rate=0.1, max_rate=10.0, rate_increase=0.1, decrease_factor=0.5,
+                 increase_every=10, latency_threshold=5.0, decrease_cooldown=5.0):
+        if not 0 < min_rate <= max_rate:
+            raise ValueError(f'0 < min_rate ({min_rate}) <= max_rate ({max_rate}) must hold!')
+        if not 0 < decrease_factor < 1:
+            raise ValueError(f'decrease_factor ({decrease_factor}) must be between 0 and 1!')
+        if rate_limiter is None:
+            rate_limiter = shared_rate_limiter
+        self._rate_limiter = rate_limiter
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._rate_increase = rate_increase
+        self._decrease_factor = decrease_factor
+        self._increase_every = increase_every
+        self._latency_threshold = latency_threshold
+        self._decrease_cooldown = decrease_cooldown
+        self._healthy_in_row = {}
+        self._last_decrease = {}
+        self._lock = Lock()
+
+    def update(self, host, latency, status_code, logger):
+        """Feed the outcome of a request (status_code is None on timeouts and network errors)"""
+        if status_code is None:
+            reason = 'timeout or network error'
+        elif status_code == 429 or status_code >= 500:
+            reason = f'HTTP {status_code}'
+        elif latency > self._latency_threshold:
+            reason = f'latency {latency:.2f}s > {self._latency_threshold:.2f}s'
+        else:
+            reason = None
+
+        with self._lock:
+            old_rate = self._rate_limiter.get_rate(host)
+            if old_rate is None:
+                return
+            now = monotonic()
+            if reason is not None:
+                self._healthy_in_row[host] = 0
+                if now - self._last_decrease.get(host, float('-inf')) < self._decrease_cooldown:
+                    return
+                self._last_decrease[host] = now
+                new_rate = max(self._min_rate, old_rate * self._decrease_factor)
+                decision = 'decrease'
+            else:
+                self._healthy_in_row[host] = self._healthy_in_row.get(host, 0) + 1
+                if self._healthy_in_row[host] < self._increase_every:
+                    return
+                self._healthy_in_row[host] = 0
+                new_rate = min(self._max_rate, old_rate + self._rate_increase)
+                reason = f'{self._increase_every} healthy responses'
+                decision = 'increase'
+            if new_rate != old_rate:
+                self._rate_limiter.set_rate(host, new_rate)
+                logger.log('INFO', 'AIMD', host, decision, f'{old_rate:.3f} -> {new_rate:.3f} requests/s', reason,
+                           sep='\t')
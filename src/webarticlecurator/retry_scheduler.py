@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from heapq import heapify, heappush, heappop
+from random import Random
+from threading import Lock
+from time import monotonic, sleep, time
+from email.utils import parsedate_to_datetime
+
+# Transient HTTP errors which are worth retrying later (the rest is considered to be permanent)
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
+def parse_retry_after(value):
+    """Retry-After header (delay-seconds or HTTP-date) -> seconds to wait or None if missing or malformed"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_date is None:
+        return None
+    return max(0.0, retry_date.timestamp() - time())
+
+
+class RetryPolicy:
+    """
+        How many times and when to retry the transient failures (network errors, HTTP 429, 5xx, etc.):
+         the n-th retry is due after min(max_delay, base_delay * 2 ** (n - 1)) seconds randomised by +/- jitter
+         (ratio) to avoid retrying together, but not sooner than the server asked for in its Retry-After header
+         (which is capped by max_delay as well)
+        The same policy can be shared between downloaders as each downloader has its own RetryScheduler
+    """
+    def __init__(self, max_tries=3, base_delay=1.0, max_delay=300.0, jitter=0.5, seed=None):
+        if max_tries < 1 or base_delay < 0 or max_delay < base_delay or not 0 <= jitter < 1:
+            raise ValueError(f'Invalid retry policy: max_tries ({max_tries}) >= 1, 0 <= base_delay ({base_delay})'
+                             f' <= max_delay ({max_delay}) and 0 <= jitter ({jitter}) < 1 must hold!')
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._random = Random(seed)
+
+    def delay(self, retry_no, retry_after=None):
+        """The seconds to wait before the retry_no-th retry (starting from 1)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (retry_no - 1))
+        delay *= self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+
+class RetryScheduler:
+    """
+        Delayed queue of URLs to retry: failed URLs are scheduled according to the RetryPolicy
+         and the caller can process other URLs until they are due (see due_urls() and wait_for_due_urls())
+        A URL is given up (schedule() returns None) after max_tries tries
+    """
+    def __init__(self, policy):
+        self._policy = policy
+        self._heap = []  # (due time, sequence number, URL)
+        self._seq = 0  # Keep the scheduling order among the URLs with the same due time
+        self._tries = {}  # URL -> no. of failed tries so far
+        self._scheduled = set()
+        self._lock = Lock()
+
+    def schedule(self, url, retry_after=None):
+        """Register a failed try and return the seconds to wait before the retry or None if no tries left"""
+        with self._lock:
+            tries = self._tries.get(url, 0) + 1
+            if tries >= self._policy.max_tries:
+                self._tries.pop(url, None)
+                self._scheduled.discard(url)
+                return None
+            self._tries[url] = tries
+            delay = self._policy.delay(tries, retry_after)
+            heappush(self._heap, (monotonic() + delay, self._seq, url))
+            self._seq += 1
+            self._scheduled.add(url)
+            return delay
+
+    def postpone(self, url, delay):
+        """Schedule the URL after delay seconds without counting it as a failed try (e.g. the host is paused)"""
+        with self._lock:
+            heappush(self._heap, (monotonic() + delay, self._seq, url))
+            self._seq += 1
+            self._scheduled.add(url)
+
+    def is_scheduled(self, url):
+        with self._lock:
+            return url in self._scheduled
+
+    def forget(self, url):
+        """The URL is downloaded successfully or failed permanently: forget its previous tries"""
+        with self._lock:
+            self._tries.pop(url, None)
+
+    def due_urls(self):
+        """Pop the URLs which are due for retrying (does not block)"""
+        now = monotonic()
+        ret = []
+        with self._lock:
+            while len(self._heap) > 0 and self._heap[0][0] <= now:
+                _, _, url = heappop(self._heap)
+                self._scheduled.discard(url)
+                ret.append(url)
+        return ret
+
+    def wait_for_due_urls(self):
+        """Yield the scheduled URLs (also the ones which are scheduled while iterating) sleeping until they are due"""
+        while True:
+            with self._lock:
+                if len(self._heap) == 0:
+                    break
+                wait = self._heap[0][0] - monotonic()
+            if wait > 0:
+                sleep(wait)
+            yield from self.due_urls()
+
+    def wait_for(self, url):
+        """
+            Sleep until the retry of the URL is due and unschedule it (the other URLs stay scheduled),
+             returns False if the URL is not scheduled
+        """
+        with self._lock:
+            due_times = [due_time for due_time, _, scheduled_url in self._heap if scheduled_url == url]
+        if len(due_times) == 0:
+            return False
+        wait = min(due_times) - monotonic()
+        if wait > 0:
+            sleep(wait)
+        self.unschedule(url)
+        return True
+
+    def unschedule(self, url):
+        """Drop the pending retries of the URL (e.g. it is not needed anymore), the other URLs stay scheduled"""
+        with self._lock:
+            self._heap = [entry for entry in self._heap if entry[2] != url]
+            heapify(self._heap)
+            self._scheduled.discard(url)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
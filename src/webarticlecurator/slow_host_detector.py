@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from threading import Lock
+from collections import deque
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of a non-empty sorted list"""
+    rank = max(1, -(-len(sorted_values) * pct // 100))  # Ceiling division
+    return sorted_values[int(rank) - 1]
+
+
+class SlowHostDetector:
+    """
+        Track the latency (headers and body) of the last window responses per host and flag the host as slow when
+         the pct-th percentile (the tail latency) exceeds slow_threshold seconds (at least min_samples are needed).
+        The host is not slow anymore when the tail latency gets below the threshold again
+        The update() method returns the new state on state changes (else None) to be able to log them
+    """
+    def __init__(self, slow_threshold=10.0, pct=95, window=50, min_samples=10):
+        if slow_threshold <= 0 or not 0 < pct <= 100 or not 0 < min_samples <= window:
+            raise ValueError(f'Invalid slow host detector settings: slow_threshold ({slow_threshold}) > 0,'
+                             f' 0 < pct ({pct}) <= 100 and 0 < min_samples ({min_samples}) <= window ({window})'
+                             f' must hold!')
+        self._slow_threshold = slow_threshold
+        self._pct = pct
+        self._window = window
+        self._min_samples = min_samples
+        self._latencies = {}  # Host -> deque of the last latencies
+        self._slow_hosts = set()
+        self._lock = Lock()
+
+    def update(self, host, latency):
+        with self._lock:
+            latencies = self._latencies.get(host)
+            if latencies is None:
+                latencies = deque(maxlen=self._window)
+                self._latencies[host] = latencies
+            latencies.append(latency)
+            if len(latencies) < self._min_samples:
+                return None
+            is_slow = percentile(sorted(latencies), self._pct) > self._slow_threshold
+            if is_slow == (host in self._slow_hosts):
+                return None
+            if is_slow:
+                self._slow_hosts.add(host)
+            else:
+                self._slow_hosts.discard(host)
+            return is_slow
+
+    def is_slow(self, host):
+        with self._lock:
+            return host in self._slow_hosts
+
+    def stats(self):
+        """Host -> (no. of latencies in the window, median, pct-th percentile, is slow)"""
+        with self._lock:
+            ret = {}
+            for host, latencies in self._latencies.items():
+                sorted_latencies = sorted(latencies)
+                ret[host] = (len(sorted_latencies), percentile(sorted_latencies, 50),
+                             percentile(sorted_latencies, self._pct), host in self._slow_hosts)
+            return ret
+
+    @property
+    def pct(self):
+        return self._pct
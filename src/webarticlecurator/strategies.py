@@ -3,7 +3,7 @@ from calendar import monthrange, isleap
 
 from mplogger import Logger, DummyLogger
 
-from .utils import write_set_contents_to_file
+from .utils import write_set_contents_to_file, DurabilityPolicy
 
 # These are just examples and helpers and can be combined e.g. date + pagination
 
@@ -117,8 +117,17 @@ def gen_article_urls_and_subpages(base_url: str, downloader, extract_articles_an
                                   problematic_urls: set = None, problematic_urls_filename: str = None,
                                   initial_page_num: str = '0', min_pagenum: int = 0,
                                   is_infinite_scrolling: bool = False, max_tries: int = 3,
-                                  ignore_archive_cache: bool = False, logger: Logger = DummyLogger()):
-    """Generates article URLs from a supplied URL including the on-demand sub-pages that contains article URLs"""
+                                  ignore_archive_cache: bool = False, logger: Logger = DummyLogger(),
+                                  durability: DurabilityPolicy = None, deferred_pages: dict = None,
+                                  resume_from: tuple = None, decode: bool = True):
+    """
+        Generates article URLs from a supplied URL including the on-demand sub-pages that contains article URLs
+        If the downloader schedules the retry of a failed page (see RetryPolicy), the generator stops and notes
+         the page into deferred_pages (page URL -> (base URL, page number, first page)) to be continued later by
+         supplying this tuple as resume_from. Without deferred_pages the generator sleeps until the retry is due.
+        With decode=False the pages are passed to extract_articles_and_gen_next_page_link_fun as raw bytes
+         (HTMLBytes, see accepts_bytes)
+    """
     if bad_urls is None:
         bad_urls = set()
     if good_urls is None:
@@ -130,15 +139,17 @@ def gen_article_urls_and_subpages(base_url: str, downloader, extract_articles_an
     tries_left = max_tries
     first_page = True
 
-    with write_set_contents_to_file(good_urls, good_urls_filename) as good_urls_add, \
-            write_set_contents_to_file(problematic_urls, problematic_urls_filename) as problematic_urls_add:
-        # 1) Add initial pagenum if there is any
+    with write_set_contents_to_file(good_urls, good_urls_filename, durability) as good_urls_add, \
+            write_set_contents_to_file(problematic_urls, problematic_urls_filename, durability) as problematic_urls_add:
+        # 1) Add initial pagenum if there is any or continue from the deferred page
         next_page_url = base_url.replace('#pagenum', initial_page_num)
+        if resume_from is not None:
+            next_page_url, page_num, first_page = resume_from
         while next_page_url is not None or tries_left > 0:
-            # 2) Download the page
-            raw_html = downloader.download_url(next_page_url, ignore_archive_cache)
+            # 2) Download the page (by its canonical URL, see UrlNormalizer)
+            curr_page_url = downloader.normalize_url(next_page_url)
+            raw_html = downloader.download_url(curr_page_url, ignore_archive_cache, decode=decode)
             tries_left -= 1
-            curr_page_url = next_page_url
             next_page_url = None
 
             # 3) Process downloaded page
@@ -163,10 +174,27 @@ def gen_article_urls_and_subpages(base_url: str, downloader, extract_articles_an
                 # 3a-IV) Yield article urls
                 yield from article_urls
 
-            elif tries_left > 0:  # 3b) Retry download
+            elif downloader.is_retry_scheduled(curr_page_url):  # 3b) Retry download later
+                if deferred_pages is not None:  # Other pages are processed meanwhile
+                    logger.log('WARNING', curr_page_url, 'Archive page is deferred until its retry is due!', sep='\t')
+                    deferred_pages[curr_page_url] = (base_url, page_num, first_page)
+                    break
+                downloader.wait_for_retry(curr_page_url)  # Nothing to do meanwhile
+                tries_left = 1
+                next_page_url = curr_page_url
+            elif curr_page_url in downloader.aliases:  # 3b') Redirected to an already downloaded page
+                tries_left = 0
+                logger.log('WARNING', curr_page_url, 'Archive page redirects to an already downloaded page!', sep='\t')
+            elif curr_page_url in downloader.rejected_urls:  # 3b'') Rejected response (size or content type)
+                tries_left = 0  # The same response would be rejected again
+                logger.log('WARNING', curr_page_url, 'Archive page is not processed because its response was'
+                                                     ' rejected!', sep='\t')
+            elif tries_left > 0 and not downloader.defers_retries and not downloader.is_backing_off(curr_page_url):
+                # 3c) Retry download immediately (unless the failure store holds it back anyway)
                 logger.log('WARNING', curr_page_url, f'Retrying URL ({max_tries - tries_left})!', sep='\t')
-                next_page_url = curr_page_url  # 3b-I) Restore URL for retrying
-            else:  # 3c) Download failed
+                next_page_url = curr_page_url  # 3c-I) Restore URL for retrying
+            else:  # 3d) Download failed
+                tries_left = 0  # Also when the retries were deferred
                 if curr_page_url not in bad_urls and curr_page_url not in downloader.good_urls and \
                         curr_page_url not in downloader.url_index:  # URLs in url_index should not be a problem
                     problematic_urls_add(curr_page_url)  # New possibly bad URL
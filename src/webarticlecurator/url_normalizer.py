@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, quote, unquote
+
+# Tracking parameters which never change the content of the page (shell-style patterns)
+DEFAULT_DROP_PARAMS = ('utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# The characters allowed in the path besides the unreserved ones (RFC 3986 pchar: sub-delims, ':' and '@') and the
+#  already percent-encoded octets: ;params, C++, (...) etc. must be kept as they are to keep the URL equivalent
+PATH_SAFE_CHARS = "/%!$&'()*+,;=:@"
+
+
+class UrlNormalizer:
+    """
+        Canonicalize the URLs with SURT-style rules before they enter the frontier to deduplicate the variants
+         of the same page. The result is still a URL which can be downloaded and it is used as the key in the WARC files
+        Always applied: lowercase scheme and host, no default port, no trailing dot in the host, '/' for the empty
+         path, percent-encoding of the characters not allowed in the path (e.g. space, non-ASCII), no empty query
+        Configurable (per site, see url_normalization in the site schema):
+         - drop_params: the query parameters to drop (shell-style patterns, e.g. utm_*)
+         - drop_fragment: drop the #fragment (it is not sent to the server anyway)
+         - strip_trailing_slash: /cikk/ -> /cikk (the root path is kept)
+         - lowercase_path: for the sites with case-insensitive paths
+         - sort_query: sort the query parameters (their order does not matter for most sites)
+         - strip_www: www.example.com -> example.com (for the sites which serve both)
+        The results of normalize() are memoized (memo_size URLs)
+    """
+    def __init__(self, drop_params=DEFAULT_DROP_PARAMS, drop_fragment=True, strip_trailing_slash=False,
+                 lowercase_path=False, sort_query=False, strip_www=False, memo_size=1000000):
+        self._drop_params = tuple(drop_params)
+        self._drop_fragment = drop_fragment
+        self._strip_trailing_slash = strip_trailing_slash
+        self._lowercase_path = lowercase_path
+        self._sort_query = sort_query
+        self._strip_www = strip_www
+        self.normalize = lru_cache(maxsize=memo_size)(self.canonicalize)
+
+    def _keep_param(self, param):
+        name = unquote(param.split('=', 1)[0])
+        return not any(fnmatchcase(name, pattern) for pattern in self._drop_params)
+
+    def canonicalize(self, url):
+        """Normalize the URL without memoization (e.g. for the URLs of a whole index which are seen only once)"""
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:  # Invalid port or IPv6 address: leave it to the downloader to handle
+            return url
+        scheme, netloc, path, query, fragment = parts
+        scheme = scheme.lower()
+
+        # Host (the credentials are kept as is)
+        userinfo, at, hostport = netloc.rpartition('@')
+        host = hostport.lower()
+        if port is not None:
+            host = host.rpartition(':')[0]
+            if DEFAULT_PORTS.get(scheme) == port:
+                port = None
+        host = host.rstrip('.')
+        if self._strip_www and host.startswith('www.'):
+            host = host[4:]
+        netloc = f'{userinfo}{at}{host}' if port is None else f'{userinfo}{at}{host}:{port}'
+
+        # Path
+        path = quote(path, safe=PATH_SAFE_CHARS)
+        if len(path) == 0:
+            path = '/'
+        if self._lowercase_path:
+            path = path.lower()
+        if self._strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        # Query (the parameters are kept as written, not re-encoded)
+        if len(query) > 0 and (len(self._drop_params) > 0 or self._sort_query):
+            params = [param for param in query.split('&') if len(param) > 0 and self._keep_param(param)]
+            if self._sort_query:
+                params.sort()
+            query = '&'.join(params)
+
+        if self._drop_fragment:
+            fragment = ''
+        return urlunsplit((scheme, netloc, path, query, fragment))
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+import os
 import sys
 import importlib.util
+from time import monotonic
+from threading import Lock, Timer
+from weakref import finalize
 from pathlib import Path
 from argparse import Namespace
 from contextlib import contextmanager
@@ -126,6 +130,9 @@ def wrap_input_constants(current_task_config_filename):
         column_settings['max_pagenum'] = max_pagenum
 
     settings['new_article_url_threshold'] = settings.get('new_article_url_threshold')
+    settings['max_body_size'] = settings.get('max_body_size')
+    settings['allowed_content_types'] = settings.get('allowed_content_types')
+    settings['url_normalization'] = settings.get('url_normalization', {})
 
     # Portal specific functions
     file_path = settings['portal_specific_exctractor_functions_file']
@@ -204,6 +211,21 @@ def create_or_check_clean_dir(out_dir):
         exit(1)
 
 
+def accepts_bytes(fun_or_class):
+    """
+        Decorator for the extractor functions and corpus converter classes which can process the raw bytes of the pages
+         (HTMLBytes with the known or sniffed encoding, e.g. BeautifulSoup(page, 'lxml', from_encoding=page.encoding))
+         instead of the decoded str: the pages are not decoded for them
+    """
+    fun_or_class.accepts_bytes = True
+    return fun_or_class
+
+
+def is_accepting_bytes(fun_or_obj):
+    return getattr(fun_or_obj, 'accepts_bytes', False) is True
+
+
+@accepts_bytes
 class DummyConverter:  # No output corpus
     """
         An example converter to showcase API and to suppress any article processing at crawling time (for new portals)
@@ -242,15 +264,126 @@ class DummyConverter:  # No output corpus
         pass
 
 
+class DurabilityPolicy:
+    """
+        Decide how often the buffered output files (WARC records, URL lists) are flushed to the OS:
+         - none: only when the file is closed (fastest, the whole buffer can be lost on crash)
+         - interval: at the end of the first record after flush_interval seconds elapsed since the last flush,
+            or by a timer flush_interval seconds after the last flush if no more records come meanwhile
+            (the records of at most the last flush_interval seconds and the current record can be lost on crash)
+         - per-record: at the end of every record (slowest, at most the current record can be lost on crash)
+        If fsync is True, every flush is followed by os.fsync() to survive OS crashes or power loss too
+    """
+    modes = ('none', 'interval', 'per-record')
+    buffer_size = 1024 * 1024  # Batch the small writes in memory between two flushes
+
+    def __init__(self, mode='interval', flush_interval=1.0, fsync=False):
+        if mode not in self.modes:
+            raise ValueError(f'Durability mode must be one of {self.modes} not {mode} !')
+        if flush_interval < 0:
+            raise ValueError(f'flush_interval must be non-negative not {flush_interval} !')
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+    def open(self, fname, mode='wb', encoding=None):
+        fh = open(fname, mode, buffering=self.buffer_size, encoding=encoding)
+        return DurableFile(fh, self)
+
+
+class DurableFile:
+    """
+        File handle wrapper which turns the flush() calls at the end of every record into the flushes (and fsyncs)
+         required by the DurabilityPolicy (WARCWriter calls flush() after every record)
+        In interval mode the records which are not flushed by a later record are flushed by a timer thread
+         (the writes and the flushes are serialized by a lock)
+    """
+    def __init__(self, fh, policy):
+        self._fh = fh
+        self._policy = policy
+        self._last_flush = monotonic()
+        self._timer = None
+        self._lock = Lock()
+        self.name = fh.name
+        # Close the file (and write out the buffer) on garbage collection or at the latest on interpreter exit
+        self._finalizer = finalize(self, self._close_fh, fh, policy.fsync)
+
+    def write(self, data):
+        with self._lock:
+            return self._fh.write(data)
+
+    def tell(self):
+        with self._lock:
+            return self._fh.tell()
+
+    def flush(self):
+        """The end of a record"""
+        mode = self._policy.mode
+        if mode == 'per-record':
+            self.sync()
+        elif mode == 'interval':
+            with self._lock:
+                wait = self._policy.flush_interval - (monotonic() - self._last_flush)
+                if wait <= 0:
+                    self._sync()
+                elif self._timer is None:  # Flush this record in time even if no more records come
+                    self._timer = Timer(wait, self._timed_sync)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._timer = None
+            self._sync()
+
+    def sync(self):
+        """Unconditionally flush the buffer (and fsync if required)"""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._fh.closed:
+            return
+        self._fh.flush()
+        if self._policy.fsync:
+            os.fsync(self._fh.fileno())
+        self._last_flush = monotonic()
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+    @staticmethod
+    def _close_fh(fh, fsync):
+        if not fh.closed:
+            fh.flush()
+            if fsync:
+                os.fsync(fh.fileno())
+            fh.close()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._finalizer()
+
+
 @contextmanager
-def write_set_contents_to_file(set_instance, fname=None):
+def write_set_contents_to_file(set_instance, fname=None, durability=None):
     fh = None
     if fname is not None:
-        fh = open(fname, 'w', encoding='UTF-8')  # To store FH (for closing it)
+        if durability is None:
+            durability = DurabilityPolicy()
+        fh = durability.open(fname, 'w', encoding='UTF-8')  # To store FH (for closing it)
 
     def _add_fun(elem: str):
         set_instance.add(elem)
-        print(elem, file=fh, flush=True)
+        if fh is not None:
+            fh.write(f'{elem}\n')
+            fh.flush()
+        else:  # Echo to STDOUT
+            print(elem, flush=True)
 
     try:
         yield _add_fun
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from time import sleep
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from mplogger import DummyLogger
+
+
+class _RecordingLogger(DummyLogger):
+    def __init__(self):
+        self.messages = []  # Before the logger logs anything
+        super().__init__()
+
+    def log(self, *args, **__):
+        self.messages.append(args)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+        Serve a small HTML page for every path over persistent HTTP/1.1 connections
+         /close/...: the server closes the connection after the response
+         /slow/SECONDS/...: the response is delayed
+         /status/CODE/...: the response has the given status code
+         /once/...: only the first request succeeds, the later ones get HTTP 503
+    """
+    protocol_version = 'HTTP/1.1'
+    served = set()
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            sleep(float(self.path.split('/')[2]))
+        status = int(self.path.split('/')[2]) if self.path.startswith('/status/') else 200
+        if self.path.startswith('/once/'):
+            status = 503 if self.path in self.served else 200
+            self.served.add(self.path)
+        body = f'<html><body>{self.path}</body></html>'.encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.startswith('/close/'):
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def http_server():
+    """The base URL of a local HTTP server (see _Handler)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f'http://localhost:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def recording_logger():
+    """A logger which stores the arguments of the log() calls in its messages list"""
+    return _RecordingLogger()
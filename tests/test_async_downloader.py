@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import asyncio
+from time import sleep
+from collections import Counter
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from mplogger import DummyLogger
+
+from webarticlecurator.enhanced_downloader import WarcDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+
+class _ConcurrencyHandler(BaseHTTPRequestHandler):
+    """Serve every path slowly and track the peak number of the concurrent requests in total and per Host header"""
+    protocol_version = 'HTTP/1.1'
+    lock = Lock()
+    active = Counter()
+    peaks = Counter()
+
+    def log_message(self, *_):
+        pass
+
+    def _enter(self, key, delta):
+        with self.lock:
+            self.active[key] += delta
+            self.peaks[key] = max(self.peaks[key], self.active[key])
+
+    def do_GET(self):
+        host = self.headers['Host']
+        self._enter(None, 1)  # In total
+        self._enter(host, 1)
+        sleep(0.1)
+        self._enter(host, -1)
+        self._enter(None, -1)
+        body = f'<html><body>{self.path}</body></html>'.encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def concurrency_server():
+    _ConcurrencyHandler.active.clear()
+    _ConcurrencyHandler.peaks.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ConcurrencyHandler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('max_in_flight, max_per_host', [(3, 2), (2, 4)])
+def test_in_flight_window_and_host_limit(concurrency_server, tmp_path, max_in_flight, max_per_host):
+    hosts = (f'localhost:{concurrency_server}', f'127.0.0.1:{concurrency_server}')  # Two hosts for the same server
+    urls = [f'http://{host}/page/{i}' for host in hosts for i in range(6)]
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), max_in_flight=max_in_flight,
+                                max_per_host=max_per_host)
+
+    async def download_all():
+        return await asyncio.gather(*(downloader.download_url_async(url) for url in urls))
+
+    texts = asyncio.run(download_all())
+    downloader.close()
+    assert texts == [f'<html><body>{url[url.index("/page/"):]}</body></html>' for url in urls]
+    peaks = _ConcurrencyHandler.peaks
+    assert peaks[None] == max_in_flight  # The window is full, but never exceeded
+    assert all(peaks[host] <= max_per_host for host in hosts)
+    assert max(peaks[host] for host in hosts) == min(max_in_flight, max_per_host)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import gzip
+import tracemalloc
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from mplogger import DummyLogger
+
+from webarticlecurator.enhanced_downloader import WarcDownloader, ResponseRejected, decode_content_encoding
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+BOMB_SIZE = 64 * 1024 * 1024
+BOMB = gzip.compress(b'\0' * BOMB_SIZE)  # ~64 KB
+PAGE = gzip.compress(b'<html><body>' + b'x' * 10000 + b'</body></html>')
+LIMIT = 1024 * 1024
+
+
+class _GzipHandler(BaseHTTPRequestHandler):
+    """/bomb: the gzip compressed BOMB_SIZE zero bytes, anything else: a small gzip compressed page"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        body = BOMB if self.path == '/bomb' else PAGE
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def gzip_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _GzipHandler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _peak_memory(fun, *args):
+    tracemalloc.start()
+    try:
+        ret = fun(*args)
+        return ret, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_decoding_stops_at_the_limit():
+    assert decode_content_encoding(PAGE, 'gzip', LIMIT) == gzip.decompress(PAGE)
+    assert len(decode_content_encoding(BOMB, 'gzip')) == BOMB_SIZE  # Without limit
+    with pytest.raises(ResponseRejected):
+        decode_content_encoding(BOMB, 'gzip', LIMIT)
+
+
+def test_compression_bomb_is_rejected(gzip_server, tmp_path):
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), max_body_size=LIMIT)
+    text, peak = _peak_memory(downloader.download_url, f'{gzip_server}/bomb')
+    assert text is None and f'{gzip_server}/bomb' in downloader.rejected_urls
+    assert peak < 8 * LIMIT  # The bomb is not inflated into the memory
+    assert downloader.download_url(f'{gzip_server}/page') == gzip.decompress(PAGE).decode('UTF-8')
+    downloader.close()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from mplogger import DummyLogger
+
+from webarticlecurator import circuit_breaker
+from webarticlecurator.circuit_breaker import HostCircuitBreakers, CLOSED, OPEN, HALF_OPEN
+from webarticlecurator.enhanced_downloader import WarcDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _breakers(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker, 'monotonic', clock)
+    return HostCircuitBreakers(failure_threshold=2, open_timeout=10.0, max_open_timeout=30.0), clock
+
+
+def test_closed_open_half_open_closed(monkeypatch):
+    breakers, clock = _breakers(monkeypatch)
+    assert breakers.record_failure('h') is None
+    assert breakers.check('h') is None
+    assert breakers.record_failure('h') == OPEN
+    assert breakers.check('h') == 10.0
+    assert breakers.check('other') is None  # The other hosts are not affected
+
+    clock.now += 10.0
+    assert breakers.check('h') is None  # The probe
+    assert breakers.states() == {'h': HALF_OPEN}
+    assert breakers.check('h') == 10.0  # The others wait for the outcome of the probe
+    assert breakers.record_success('h') == CLOSED
+    assert breakers.states() == {}
+    assert breakers.check('h') is None
+
+
+def test_failed_probe_doubles_the_timeout(monkeypatch):
+    breakers, clock = _breakers(monkeypatch)
+    breakers.record_failure('h')
+    breakers.record_failure('h')
+    for timeout in (20.0, 30.0, 30.0):  # At most max_open_timeout
+        clock.now += 30.0
+        assert breakers.check('h') is None
+        assert breakers.record_failure('h') == OPEN
+        assert breakers.open_timeout('h') == breakers.check('h') == timeout
+    clock.now += 30.0
+    assert breakers.check('h') is None
+    assert breakers.record_success('h') == CLOSED
+    assert breakers.open_timeout('h') == 10.0
+
+
+def test_released_probe_lets_the_next_request_probe(monkeypatch):
+    breakers, clock = _breakers(monkeypatch)
+    breakers.record_failure('h')
+    breakers.record_failure('h')
+    clock.now += 10.0
+    assert breakers.check('h') is None
+    breakers.release_probe('h')
+    assert breakers.states() == {'h': OPEN}
+    assert breakers.check('h') is None
+    assert breakers.states() == {'h': HALF_OPEN}
+
+
+def test_probe_answered_with_404_closes_the_circuit(http_server, tmp_path):
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), err_threshold=1, host_pause=0.1)
+    assert downloader.download_url(f'{http_server}/status/500/a') is None
+    assert set(downloader._circuit_breakers.states().values()) == {OPEN}
+    assert downloader.download_url(f'{http_server}/status/404/b') is None  # The probe after the pause
+    assert downloader._circuit_breakers.states() == {}
+    assert downloader.download_url(f'{http_server}/c') == '<html><body>/c</body></html>'
+    downloader.close()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import asyncio
+from time import sleep
+
+from mplogger import DummyLogger
+
+from webarticlecurator.enhanced_downloader import WarcCachingDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+
+def _downloader(warc_filename):
+    return WarcCachingDownloader(None, warc_filename, DummyLogger(),
+                                 download_params={'max_no_of_calls_in_period': 100, 'rate_limiter': HostRateLimiter(),
+                                                  'max_in_flight': 4, 'max_per_host': 4})
+
+
+def test_download_many(http_server, tmp_path):
+    downloader = _downloader(str(tmp_path / 'out.warc.gz'))
+    urls = [f'{http_server}/page/{i}' for i in range(10)]
+    results = dict(downloader.download_many(urls + urls[:3], max_pending=3))  # The duplicates are dropped
+    downloader.close()
+    assert results == {url: f'<html><body>{url[len(http_server):]}</body></html>' for url in urls}
+    assert downloader.good_urls == set(urls)
+
+
+def test_early_close_keeps_the_running_downloads_in_flight(http_server, tmp_path):
+    downloader = _downloader(str(tmp_path / 'out.warc.gz'))
+    urls = [f'{http_server}/page/fast'] + [f'{http_server}/slow/0.5/{i}' for i in range(3)]
+    pairs = downloader.download_many(urls)
+    assert next(pairs) == (urls[0], '<html><body>/page/fast</body></html>')
+    pairs.close()  # The slow downloads are still running in the worker threads
+    in_flight = downloader._new_downloads._in_flight_urls
+    assert in_flight == set(urls[1:])
+    assert asyncio.run(downloader.download_url_async(urls[1])) is None  # Not downloaded twice at the same time
+    sleep(1.0)
+    assert len(in_flight) == 0
+    downloader.close()
+    assert downloader.good_urls == {urls[0]}  # The unfinished downloads are not written
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from time import sleep
+
+import pytest
+
+from webarticlecurator import utils
+from webarticlecurator.utils import DurabilityPolicy, write_set_contents_to_file
+
+
+def _file_contents(fname):
+    with open(fname, encoding='UTF-8') as fh:
+        return fh.read()
+
+
+class _ManualTimer:
+    """Stand-in for threading.Timer which is fired by the test instead of a thread"""
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def manual_clock_and_timers(monkeypatch):
+    """Replace the clock and the timers of the durable files: the test advances the clock and fires the timers"""
+    clock = [0.0]
+    timers = []
+
+    def create_timer(interval, function):
+        timers.append(_ManualTimer(interval, function))
+        return timers[-1]
+
+    monkeypatch.setattr(utils, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(utils, 'Timer', create_timer)
+    return clock, timers
+
+
+def test_interval_mode_flushes_on_timer(tmp_path, manual_clock_and_timers):
+    clock, timers = manual_clock_and_timers
+    fname = str(tmp_path / 'urls.txt')
+    urls = set()
+    with write_set_contents_to_file(urls, fname, DurabilityPolicy('interval', 0.2)) as urls_add:
+        urls_add('http://ex.com/a')
+        clock[0] = 0.1
+        urls_add('http://ex.com/b')
+        assert _file_contents(fname) == ''  # Buffered until the interval elapses
+        assert len(timers) == 1 and timers[0].started and timers[0].daemon and timers[0].interval == 0.2
+
+        clock[0] = 0.2
+        timers[0].function()  # No more records: flushed by the timer
+        assert _file_contents(fname) == 'http://ex.com/a\nhttp://ex.com/b\n'
+
+        clock[0] = 0.5
+        urls_add('http://ex.com/c')  # The interval is already elapsed
+        assert _file_contents(fname) == 'http://ex.com/a\nhttp://ex.com/b\nhttp://ex.com/c\n'
+        assert len(timers) == 1
+
+        urls_add('http://ex.com/d')  # A new timer for the next interval
+        assert len(timers) == 2 and timers[1].interval == 0.2
+    assert timers[1].cancelled  # The file is flushed by closing it
+    assert _file_contents(fname) == 'http://ex.com/a\nhttp://ex.com/b\nhttp://ex.com/c\nhttp://ex.com/d\n'
+    assert urls == {'http://ex.com/a', 'http://ex.com/b', 'http://ex.com/c', 'http://ex.com/d'}
+
+
+def test_none_mode_flushes_on_close(tmp_path):
+    fname = str(tmp_path / 'urls.txt')
+    with write_set_contents_to_file(set(), fname, DurabilityPolicy('none')) as urls_add:
+        urls_add('http://ex.com/a')
+        sleep(0.1)
+        assert _file_contents(fname) == ''
+    assert _file_contents(fname) == 'http://ex.com/a\n'
+
+
+def test_echo_to_stdout_without_filename(capsys):
+    urls = set()
+    with write_set_contents_to_file(urls) as urls_add:
+        urls_add('http://ex.com/a')
+    assert capsys.readouterr().out == 'http://ex.com/a\n'
+    assert urls == {'http://ex.com/a'}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import socket
+import asyncio
+import subprocess
+from time import sleep
+from shutil import which
+from threading import Thread
+
+import pytest
+from mplogger import DummyLogger
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator.enhanced_downloader import WarcDownloader, WarcReader
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+pytest.importorskip('httpx')
+pytest.importorskip('h2')
+hypercorn_asyncio = pytest.importorskip('hypercorn.asyncio')
+hypercorn_config = pytest.importorskip('hypercorn.config')
+
+CLIENT_PORTS = set()  # The client side port of every connection served
+HTTP_VERSIONS = set()
+
+
+async def _app(scope, _, send):
+    if scope['type'] != 'http':
+        return
+    CLIENT_PORTS.add(scope['client'][1])
+    HTTP_VERSIONS.add(scope['http_version'])
+    await asyncio.sleep(0.1)  # Let the concurrent requests overlap
+    body = f'<html><head><meta charset="utf-8"></head><body>{scope["path"]} árvíztűrő</body></html>'.encode('UTF-8')
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/html'), (b'content-length', str(len(body)).encode('ascii'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def h2_server(tmp_path_factory):
+    """The base URL of a local HTTP/2 server (TLS with a self-signed certificate, ALPN h2)"""
+    if which('openssl') is None:
+        pytest.skip('openssl is needed to create the certificate of the test server')
+    cert_dir = tmp_path_factory.mktemp('cert')
+    certfile, keyfile = str(cert_dir / 'cert.pem'), str(cert_dir / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', keyfile, '-out', certfile], check=True, capture_output=True)
+
+    port = _free_port()
+    config = hypercorn_config.Config()
+    config.bind = [f'127.0.0.1:{port}']
+    config.certfile, config.keyfile = certfile, keyfile
+    config.loglevel = 'ERROR'
+    loop = asyncio.new_event_loop()
+    shutdown_events = []
+
+    async def serve():
+        shutdown_events.append(asyncio.Event())  # Created in the loop of the server
+        await hypercorn_asyncio.serve(_app, config, shutdown_trigger=shutdown_events[0].wait)
+
+    thread = Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    for _ in range(100):  # Wait until the server is up
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            sleep(0.05)
+    yield f'https://localhost:{port}'
+    loop.call_soon_threadsafe(shutdown_events[0].set)
+    thread.join(5)
+
+
+def _downloader(filename):
+    return WarcDownloader(filename, DummyLogger(), max_no_of_calls_in_period=100, rate_limiter=HostRateLimiter(),
+                          verify_request=False, http2=True, max_in_flight=8, max_per_host=8)
+
+
+def test_requests_are_multiplexed_over_one_connection(h2_server, tmp_path):
+    CLIENT_PORTS.clear()
+    HTTP_VERSIONS.clear()
+    warc_filename = str(tmp_path / 'out.warc.gz')
+    downloader = _downloader(warc_filename)
+
+    async def download_all():
+        return await asyncio.gather(*(downloader.download_url_async(f'{h2_server}/page/{i}') for i in range(8)))
+
+    texts = asyncio.run(download_all())
+    downloader.close()
+    assert texts == [f'<html><head><meta charset="utf-8"></head><body>/page/{i} árvíztűrő</body></html>'
+                     for i in range(8)]
+    assert HTTP_VERSIONS == {'2'}
+    assert len(CLIENT_PORTS) == 1
+
+    with open(warc_filename, 'rb') as fh:
+        protocols = {rec.http_headers.protocol for rec in ArchiveIterator(fh) if rec.rec_type == 'response'}
+    assert protocols == {'HTTP/2'}
+
+
+def test_records_are_valid(h2_server, tmp_path):
+    warc_filename = str(tmp_path / 'out.warc.gz')
+    downloader = _downloader(warc_filename)
+    text = downloader.download_url(f'{h2_server}/page/valid')
+    downloader.close()
+
+    reader = WarcReader(warc_filename, DummyLogger(), strict_mode=True, check_digest=True)
+    assert reader.download_url(f'{h2_server}/page/valid') == text
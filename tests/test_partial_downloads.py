@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from mplogger import DummyLogger
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator.enhanced_downloader import WarcDownloader
+from webarticlecurator.partial_downloads import PartialDownloads
+from webarticlecurator.rate_limiter import HostRateLimiter
+from webarticlecurator.retry_scheduler import RetryPolicy
+
+PAYLOAD = bytes(range(256)) * 400
+ETAG = '"v2"'
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """
+        Serve PAYLOAD (ETag: ETAG) with byte range support: 206 for a satisfiable Range if If-Range matches,
+         416 if it is beyond the payload and the whole payload if If-Range does not match
+         /broken/...: the first response is interrupted in the middle of the payload
+    """
+    protocol_version = 'HTTP/1.1'
+    hits = {}
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        hits = self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header is not None and self.headers.get('If-Range') == ETAG:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(PAYLOAD)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('ETag', ETAG)
+        self.send_header('Accept-Ranges', 'bytes')
+        if start > 0:
+            self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+        self.send_header('Content-Length', str(len(PAYLOAD) - start))
+        self.end_headers()
+        if self.path.startswith('/broken/') and hits == 1:
+            self.wfile.write(PAYLOAD[start:len(PAYLOAD) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(PAYLOAD[start:])
+
+
+@pytest.fixture
+def range_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _save_partial(partials, url, validator, size, length):
+    meta = {'status': '200 OK', 'proto': 'HTTP/1.1', 'validator': validator, 'length': length,
+            'headers': [['Content-Type', 'application/octet-stream'], ['ETag', validator],
+                        ['Accept-Ranges', 'bytes'], ['Content-Length', str(length)]]}
+    assert partials.save(url, meta, [b'x' * size])
+
+
+def _response_payloads(warc_filename):
+    with open(warc_filename, 'rb') as fh:
+        return [rec.content_stream().read() for rec in ArchiveIterator(fh, check_digests='raise')
+                if rec.rec_type == 'response']
+
+
+def test_unsatisfiable_range_starts_over(range_server, tmp_path):
+    url = f'{range_server}/too-long'
+    partials = PartialDownloads(str(tmp_path / 'partial'))
+    _save_partial(partials, url, ETAG, len(PAYLOAD) + 10, len(PAYLOAD) + 20)  # E.g. the payload has shrunk
+    warc_filename = str(tmp_path / 'out.warc.gz')
+    downloader = WarcDownloader(warc_filename, DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), partial_dir=partials.spool_dir)
+    assert downloader.download_url(url, decode=False) == PAYLOAD
+    downloader.close()
+    assert partials.load(url) is None
+    assert _response_payloads(warc_filename) == [PAYLOAD]
+
+
+def test_changed_payload_is_resumed_with_its_own_validator(range_server, tmp_path):
+    url = f'{range_server}/broken/changed'
+    partials = PartialDownloads(str(tmp_path / 'partial'))
+    _save_partial(partials, url, '"v1"', 100, len(PAYLOAD))  # Stored from an earlier version of the payload
+    warc_filename = str(tmp_path / 'out.warc.gz')
+    downloader = WarcDownloader(warc_filename, DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), partial_dir=partials.spool_dir,
+                                retry_policy=RetryPolicy(3, 0.0, 0.0, 0.0))
+    assert downloader.download_url(url, decode=False) is None  # The whole new payload is interrupted
+    partial = partials.load(url)
+    assert partial['validator'] == ETAG and partial['size'] == len(PAYLOAD) // 2
+
+    assert downloader.download_url(url, decode=False) == PAYLOAD  # Resumed from the middle
+    downloader.close()
+    assert partials.load(url) is None
+    assert _response_payloads(warc_filename) == [PAYLOAD]
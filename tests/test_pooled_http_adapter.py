@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import socket
+
+import pytest
+from mplogger import DummyLogger
+from requests import Session
+
+from webarticlecurator.connection_pool import DNSCache, PooledHTTPAdapter
+from webarticlecurator.enhanced_downloader import WarcDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+
+
+def _session(adapter):
+    session = Session()
+    session.mount('http://', adapter)
+    return session
+
+
+def test_connection_is_reused(http_server):
+    adapter = PooledHTTPAdapter()
+    with _session(adapter) as session:
+        for i in range(5):
+            assert session.get(f'{http_server}/page/{i}').status_code == 200
+    assert adapter.stats.stats() == {'localhost': (1, 4, 0)}
+
+
+def test_closed_connection_is_replaced(http_server):
+    adapter = PooledHTTPAdapter()
+    with _session(adapter) as session:
+        for i in range(3):
+            assert session.get(f'{http_server}/close/{i}').status_code == 200
+    new_conns, reused_conns, _ = adapter.stats.stats()['localhost']
+    assert new_conns == 3 and reused_conns == 0
+
+
+@pytest.mark.parametrize('keep_alive', [True, False])
+def test_tcp_keep_alive(http_server, keep_alive):
+    with _session(PooledHTTPAdapter(keep_alive=keep_alive)) as session:
+        resp = session.get(f'{http_server}/page', stream=True)
+        sock = resp.raw._connection.sock
+        assert bool(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)) == keep_alive
+        resp.close()
+
+
+def test_dns_cache(http_server):
+    dns_cache = DNSCache(ttl=300.0)
+    adapter = PooledHTTPAdapter(dns_cache=dns_cache)
+    with _session(adapter) as session:
+        for i in range(3):  # New connection for every request
+            assert session.get(f'{http_server}/close/{i}').text == f'<html><body>/close/{i}</body></html>'
+    assert dns_cache.lookups['localhost'] == 1
+    assert adapter.stats.stats()['localhost'][0] == 3
+
+
+def test_dns_cache_expiry():
+    dns_cache = DNSCache(ttl=-1.0)  # Always expired
+    assert len(dns_cache.resolve('localhost', 80)) > 0
+    assert len(dns_cache.resolve('localhost', 80)) > 0
+    assert dns_cache.lookups['localhost'] == 2
+    assert dns_cache.resolve('127.0.0.1', 80) == ['127.0.0.1']  # Addresses are not looked up
+    assert dns_cache.lookups['127.0.0.1'] == 0
+
+
+def test_downloader_keeps_connections_alive(http_server, tmp_path):
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), DummyLogger(), max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter())
+    for i in range(3):
+        assert downloader.download_url(f'{http_server}/page/{i}') == f'<html><body>/page/{i}</body></html>'
+    assert downloader._adapter.stats.stats() == {'localhost': (1, 2, 0)}
+    downloader.close()
+
+
+def test_connection_stats_are_logged_on_close(http_server, tmp_path, recording_logger):
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), recording_logger, max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter())
+    for i in range(3):
+        downloader.download_url(f'{http_server}/page/{i}')
+    downloader.close()
+    assert ('INFO', 'Connections', 'localhost', '1 new', '2 reused', '0 TLS handshakes') in recording_logger.messages
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from time import monotonic
+
+from mplogger import DummyLogger
+
+from webarticlecurator.enhanced_downloader import WarcCachingDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+from webarticlecurator.retry_scheduler import RetryPolicy, RetryScheduler, parse_retry_after
+
+
+def test_wait_for_keeps_the_other_urls_scheduled():
+    scheduler = RetryScheduler(RetryPolicy(base_delay=0.2, jitter=0))
+    scheduler.postpone('http://ex.com/b', 0.1)
+    assert scheduler.schedule('http://ex.com/a') == 0.2
+    scheduler.postpone('http://ex.com/c', 0.3)
+
+    start = monotonic()
+    assert scheduler.wait_for('http://ex.com/a')
+    assert monotonic() - start >= 0.2
+    assert not scheduler.is_scheduled('http://ex.com/a')
+    assert scheduler.due_urls() == ['http://ex.com/b']  # Already due, but not dropped
+    assert list(scheduler.wait_for_due_urls()) == ['http://ex.com/c']
+    assert not scheduler.wait_for('http://ex.com/a')
+
+
+def test_out_of_tries():
+    scheduler = RetryScheduler(RetryPolicy(max_tries=2, base_delay=0.0, jitter=0))
+    assert scheduler.schedule('http://ex.com/a') == 0.0
+    assert scheduler.schedule('http://ex.com/a') is None
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0  # In the past
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_unschedule_keeps_the_other_urls_scheduled():
+    scheduler = RetryScheduler(RetryPolicy(base_delay=0.0, jitter=0))
+    scheduler.schedule('http://ex.com/a')
+    scheduler.postpone('http://ex.com/b', 0.0)
+    scheduler.postpone('http://ex.com/a', 0.0)
+    scheduler.unschedule('http://ex.com/a')
+    assert not scheduler.is_scheduled('http://ex.com/a')
+    assert list(scheduler.wait_for_due_urls()) == ['http://ex.com/b']
+
+
+def test_failed_revalidation_is_not_retried(http_server, tmp_path):
+    url = f'{http_server}/once/a'
+    cache_filename = str(tmp_path / 'cache.warc.gz')
+    downloader = WarcCachingDownloader(None, cache_filename, DummyLogger(),
+                                       download_params={'max_no_of_calls_in_period': 100,
+                                                        'rate_limiter': HostRateLimiter()})
+    text = downloader.download_url(url)
+    downloader.close()
+
+    downloader = WarcCachingDownloader(cache_filename, str(tmp_path / 'out.warc.gz'), DummyLogger(),
+                                       download_params={'max_no_of_calls_in_period': 100,
+                                                        'rate_limiter': HostRateLimiter(),
+                                                        'retry_policy': RetryPolicy(base_delay=0.0, jitter=0)})
+    assert downloader.download_url(url, ignore_cache=True) == text  # HTTP 503: the cached copy is kept
+    assert list(downloader.wait_for_retries()) == []
+    downloader.close()
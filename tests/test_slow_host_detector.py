@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from urllib.parse import urlparse
+
+from webarticlecurator.enhanced_downloader import WarcDownloader
+from webarticlecurator.rate_limiter import HostRateLimiter
+from webarticlecurator.slow_host_detector import SlowHostDetector, percentile
+
+
+def test_percentile():
+    assert percentile([1], 95) == 1
+    assert percentile(list(range(1, 21)), 50) == 10
+    assert percentile(list(range(1, 21)), 95) == 19
+
+
+def test_slow_host_is_flagged_and_recovers():
+    detector = SlowHostDetector(slow_threshold=1.0, window=4, min_samples=2)
+    assert detector.update('h', 2.0) is None  # Not enough samples
+    assert detector.update('h', 2.0) is True
+    assert detector.is_slow('h') and not detector.is_slow('other')
+    for _ in range(3):
+        detector.update('h', 0.1)
+    assert detector.update('h', 0.1) is False
+    assert detector.stats() == {'h': (4, 0.1, 0.1, False)}
+
+
+def test_latency_summary_is_logged_on_close(http_server, tmp_path, recording_logger):
+    downloader = WarcDownloader(str(tmp_path / 'out.warc.gz'), recording_logger, max_no_of_calls_in_period=100,
+                                rate_limiter=HostRateLimiter(), slow_host_threshold=0.05)
+    for i in range(10):
+        downloader.download_url(f'{http_server}/slow/0.1/{i}')
+    downloader.close()
+    summary = [msg for msg in recording_logger.messages if msg[1:3] == ('Latency', urlparse(http_server).netloc)]
+    assert len(summary) == 1
+    level, _, _, responses, _, tail, state = summary[0]
+    assert (level, responses, state) == ('WARNING', '10 responses', 'slow')
+    assert tail.startswith('p95 ')
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import pytest
+
+from webarticlecurator.url_normalizer import UrlNormalizer
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTP://Ex.com:80', 'http://ex.com/'),
+    ('https://ex.com.:443/a#frag', 'https://ex.com/a'),
+    ('http://ex.com/a b/é', 'http://ex.com/a%20b/%C3%A9'),
+    ('http://ex.com/a%20b', 'http://ex.com/a%20b'),
+    ('http://ex.com/a?utm_source=x&id=1&fbclid=2', 'http://ex.com/a?id=1'),
+])
+def test_canonicalize(url, expected):
+    assert UrlNormalizer().canonicalize(url) == expected
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('http://Ex.com/a;jsessionid=1?x=1', 'http://ex.com/a;jsessionid=1?x=1'),
+    ('http://ex.com/wiki/C++', 'http://ex.com/wiki/C++'),
+    ('http://ex.com/p/a(b)', 'http://ex.com/p/a(b)'),
+    ("http://ex.com/p/!$&'*,=:@", "http://ex.com/p/!$&'*,=:@"),
+])
+def test_path_reserved_chars_are_kept(url, expected):
+    assert UrlNormalizer().canonicalize(url) == expected
+
+
+def test_configurable_rules():
+    normalizer = UrlNormalizer(drop_params=(), drop_fragment=False, strip_trailing_slash=True, lowercase_path=True,
+                               sort_query=True, strip_www=True)
+    assert normalizer.canonicalize('http://www.ex.com/Cikk/?b=2&a=1#x') == 'http://ex.com/cikk?a=1&b=2#x'
+    assert normalizer.canonicalize('http://www.ex.com/') == 'http://ex.com/'
+
+
+def test_normalize_is_memoized():
+    normalizer = UrlNormalizer(memo_size=10)
+    assert normalizer.normalize('http://EX.com/a') == normalizer.normalize('http://EX.com/a') == 'http://ex.com/a'
+    assert normalizer.normalize.cache_info().hits == 1
+
+
+def test_invalid_port_is_left_as_is():
+    assert UrlNormalizer().canonicalize('http://ex.com:port/a') == 'http://ex.com:port/a'